@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+APNG 元数据解析
+直接读取 PNG 块结构（IHDR/acTL/fcTL），获取帧数、帧延时、偏移、
+dispose/blend 操作和尺寸，不解压任何 IDAT/fdAT 图像数据。
+"""
+
+import struct
+from pathlib import Path
+from typing import BinaryIO, Iterator, Tuple
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG 颜色类型 → PIL 模式
+COLOR_TYPE_MODES = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+
+DISPOSE_OPS = {0: 'none', 1: 'background', 2: 'previous'}
+BLEND_OPS = {0: 'source', 1: 'over'}
+
+
+def is_png(path) -> bool:
+    """判断文件是否为 PNG（包括 APNG）"""
+    with open(path, 'rb') as f:
+        return f.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE
+
+
+def iter_chunks(fp: BinaryIO, read_data=lambda chunk_type: True) -> Iterator[Tuple[bytes, int, int, bytes]]:
+    """遍历 PNG 块，产出 (类型, 数据偏移, 数据长度, 数据)
+
+    read_data(chunk_type) 返回 False 的块只跳过不读取，数据为 b''。
+    """
+    signature = fp.read(len(PNG_SIGNATURE))
+    if signature != PNG_SIGNATURE:
+        raise ValueError("不是有效的 PNG 文件")
+
+    while True:
+        header = fp.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', header)
+        offset = fp.tell()
+
+        if read_data(chunk_type):
+            data = fp.read(length)
+            if len(data) < length:
+                raise ValueError(f"PNG 块 {chunk_type!r} 数据不完整")
+            fp.seek(4, 1)  # 跳过 CRC
+        else:
+            data = b''
+            fp.seek(length + 4, 1)
+
+        yield chunk_type, offset, length, data
+
+        if chunk_type == b'IEND':
+            return
+
+
+def parse_apng(path) -> dict:
+    """解析 APNG 元数据，不解码图像数据"""
+    path = Path(path)
+    info = {
+        'format': 'PNG',
+        'file_size_mb': path.stat().st_size / (1024 * 1024),
+        'num_plays': 0,
+        'frames': [],
+    }
+
+    ihdr = None
+    num_frames = 0
+    default_image_animated = False
+    seen_idat = False
+
+    with open(path, 'rb') as f:
+        # 图像数据块只跳过，不读取
+        for chunk_type, _, _, data in iter_chunks(f, lambda t: t not in (b'IDAT', b'fdAT')):
+            if chunk_type == b'IHDR':
+                ihdr = struct.unpack('>IIBBBBB', data)
+            elif chunk_type == b'acTL':
+                num_frames, info['num_plays'] = struct.unpack('>II', data)
+            elif chunk_type == b'fcTL':
+                (_, width, height, x_offset, y_offset,
+                 delay_num, delay_den, dispose_op, blend_op) = struct.unpack('>IIIIIHHBB', data)
+                if not seen_idat:
+                    # IDAT 之前的 fcTL 表示默认图像也是动画的第一帧
+                    default_image_animated = True
+                # 分母为 0 时按 1/100 秒处理（APNG 规范）
+                delay_ms = delay_num * 1000 / (delay_den or 100)
+                info['frames'].append({
+                    'size': (width, height),
+                    'offset': (x_offset, y_offset),
+                    'duration': delay_ms,
+                    'dispose_op': DISPOSE_OPS.get(dispose_op, dispose_op),
+                    'blend_op': BLEND_OPS.get(blend_op, blend_op),
+                })
+            elif chunk_type == b'IDAT':
+                seen_idat = True
+
+    if ihdr is None:
+        raise ValueError("缺少 IHDR 块")
+
+    width, height, bit_depth, color_type = ihdr[:4]
+    info['size'] = (width, height)
+    info['bit_depth'] = bit_depth
+    info['mode'] = COLOR_TYPE_MODES.get(color_type, 'unknown')
+    info['default_image_animated'] = default_image_animated
+
+    is_animated = num_frames > 1
+    info['is_animated'] = is_animated
+    info['n_frames'] = num_frames if num_frames else 1
+
+    if is_animated:
+        durations = [frame['duration'] for frame in info['frames']]
+        info['frame_durations'] = durations
+        info['total_duration'] = sum(durations)
+        info['fps'] = 1000 / (sum(durations) / len(durations)) if sum(durations) else 10
+
+    return info
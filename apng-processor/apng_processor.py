@@ -8,37 +8,1073 @@ APNG 动图处理器
 4. 重新合成为动图（GIF/WebP/MP4）
 """
 
+from __future__ import annotations
+
 import os
 import sys
+import json
+import shutil
+import struct
+import subprocess
 from pathlib import Path
 import argparse
-from typing import List, Tuple, Optional
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Executor
+from contextlib import nullcontext
+from typing import Callable, Iterable, Iterator, List, Tuple, Optional
 import time
 
-try:
-    from PIL import Image, ImageSequence
-    import imageio
-    import numpy as np
-    from tqdm import tqdm
-    import cv2
-except ImportError as e:
-    print(f"❌ 缺少依赖库: {e}")
-    print("请运行: pip install -r requirements.txt")
-    sys.exit(1)
+from PIL import Image, ImageSequence
+
+from apng_decoder import APNGDecoder
+from apng_parser import is_png, parse_apng
+from build_cache import BuildCache, DEFAULT_CACHE_DIR
+from compositing import DEFAULT_MATTE, composite_frame, parse_color
+from frame_store import FrameRef, FrameStore
+from lazy_imports import LazyModule, has_module, progress, require
+from pipeline_stats import PipelineStats
+from poster_frame import POSTER_STRATEGIES, PosterPicker, write_poster
+from quality_metrics import (REPORT_SAMPLE_FRAMES, ReferenceSampler, count_frames, measure_output,
+                             sample_indices, summarize)
+from resizing import RESIZE_ENGINES, resize_frame, resolve_engine
+
+# NumPy / OpenCV 在第一次使用时才导入，OpenCV 只有 opencv 视频后端需要
+np = LazyModule('numpy')
+cv2 = LazyModule('cv2')
+
+
+def ordered_map(func: Callable, iterable: Iterable[tuple],
+                executor: Optional[Executor] = None,
+                window: Optional[int] = None) -> Iterator:
+    """按输入顺序产出 func(*args) 的结果
+
+    提供 executor 时并行执行，同时最多提交 window 个任务，
+    避免一次性把整个输入序列读入内存。
+    """
+    if executor is None:
+        for args in iterable:
+            yield func(*args)
+        return
+
+    window = window or (os.cpu_count() or 1) * 2
+    pending = deque()
+    for args in iterable:
+        pending.append(executor.submit(func, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def quantize_frame(frame: Image.Image) -> Image.Image:
+    """转换为调色板模式以减小文件大小"""
+    try:
+        return frame.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+    except Exception:
+        # 如果量化失败，保持 RGB 模式
+        return frame
+
+
+# 视频编码：名称 → ffmpeg 编码器和输出文件扩展名
+VIDEO_CODECS = {
+    'h264': {'encoder': 'libx264', 'suffix': 'mp4'},
+    'vp9': {'encoder': 'libvpx-vp9', 'suffix': 'webm'},
+}
+VIDEO_BACKENDS = ('auto', 'ffmpeg', 'opencv')
+VIDEO_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast',
+                 'medium', 'slow', 'slower', 'veryslow')
+# libvpx-vp9 没有 preset，按速度映射到 cpu-used（越大越快）
+VP9_CPU_USED = {'ultrafast': 8, 'superfast': 7, 'veryfast': 6, 'faster': 5, 'fast': 4,
+                'medium': 3, 'slow': 2, 'slower': 1, 'veryslow': 0}
+
+FFMPEG = shutil.which('ffmpeg')
+
+# 多分辨率版本的默认目标高度（与 check_dimensions.py 的推荐尺寸一致）
+RENDITION_HEIGHTS = (480, 720, 1080, 1440)
+RENDITION_FORMATS = ('gif', 'webp', 'mp4')
+
+# 保留透明通道的输出格式，直接使用解码后的 RGBA 帧
+ALPHA_FORMATS = ('webp_alpha', 'apng')
+
+# 帧解码器：auto 在多核机器上对支持的 APNG 使用原生解码器（并行解压），否则使用 Pillow
+DECODERS = ('auto', 'native', 'pillow')
+
+# 目标帧率低于源帧率时的时间轴重采样方式：不重采样 / 取最近帧 / 按时长加权混合
+RESAMPLE_MODES = ('none', 'nearest', 'blend')
+
+# 目标帧率不低于源文件标称帧率（允许 2% 误差）时不重采样：
+# 66ms/帧的源文件（标称 15 fps，实际 15.15 fps）输出 15 fps 时不会丢帧
+RESAMPLE_TOLERANCE = 0.02
+
+# GIF 调色板模式：每帧独立量化 / 所有帧共享一个调色板
+GIF_PALETTE_MODES = ('frame', 'global')
+GIF_DITHER_MODES = ('none', 'ordered', 'floyd-steinberg')
+
+# 生成共享调色板时每帧最多采样的像素数
+PALETTE_SAMPLE_PIXELS = 16384
+
+# APNG 共享调色板的颜色数范围，以及生成调色板时均匀抽样的帧数
+APNG_COLOR_RANGE = (2, 256)
+APNG_PALETTE_FRAMES = 32
+
+# 把颜色映射到调色板时每批计算距离的颜色数（每批一个 batch x 256 的 float32 距离矩阵）
+PALETTE_MAP_BATCH = 4096
+
+# 8x8 Bayer 矩阵，用于有序抖动
+BAYER_8X8 = [
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+]
+
+
+def sample_pixels(frame: Image.Image, max_pixels: int = PALETTE_SAMPLE_PIXELS) -> np.ndarray:
+    """按固定步长从帧中采样像素，返回 (n, 通道数) 数组"""
+    array = np.asarray(frame)
+    height, width = array.shape[:2]
+    step = max(1, int(np.ceil(np.sqrt(height * width / max_pixels))))
+    return array[::step, ::step].reshape(-1, array.shape[2])
+
+
+def build_global_palette(samples: List[np.ndarray], colors: int = 255) -> Image.Image:
+    """用所有帧的采样像素一次性生成共享调色板，返回可用于 quantize(palette=...) 的调色板图像"""
+    pixels = np.concatenate(samples)
+    sample_image = Image.fromarray(pixels.reshape(-1, 1, 3))
+    return sample_image.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+
+
+def map_to_palette(frame: Image.Image, palette: Image.Image, dither: str = 'none') -> Image.Image:
+    """把 RGB 帧映射到共享调色板上，可选有序抖动或 Floyd–Steinberg 抖动"""
+    if dither == 'ordered':
+        array = np.asarray(frame, dtype=np.int16)
+        height, width = array.shape[:2]
+        # 把 Bayer 阈值平铺到整帧，偏移范围约为一个调色板色阶
+        offsets = np.tile(np.array(BAYER_8X8, dtype=np.int16), (height // 8 + 1, width // 8 + 1))[:height, :width]
+        offsets = (offsets - 32) // 2
+        array += offsets[..., None]
+        frame = Image.fromarray(np.clip(array, 0, 255).astype(np.uint8))
+    
+    method = Image.Dither.FLOYDSTEINBERG if dither == 'floyd-steinberg' else Image.Dither.NONE
+    return frame.quantize(palette=palette, dither=method)
+
+
+def changed_mask(reference: np.ndarray, current: np.ndarray, threshold: int = 0) -> np.ndarray:
+    """逐像素比较两帧，返回变化超过 threshold 的像素掩码 (h, w)"""
+    if threshold <= 0:
+        changed = current != reference
+    else:
+        # 在 uint8 上计算绝对差，避免转换为更宽的整数类型
+        diff = np.maximum(current, reference)
+        diff -= np.minimum(current, reference)
+        changed = diff > threshold
+    return changed.any(axis=2) if changed.ndim == 3 else changed
+
+
+def mask_bbox(mask: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """掩码中 True 像素的外接矩形 (left, top, right, bottom)，没有变化时返回 None"""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+class DeltaTracker:
+    """跟踪播放器当前显示的画面，计算每一帧相对它的变化区域
+
+    变化不超过 threshold 的像素视为未变化，保持上一次显示的值，
+    避免压缩噪声让每一帧都变成整帧更新。
+    """
+
+    def __init__(self, threshold: int = 0):
+        self.threshold = threshold
+        self.reference = None
+
+    def update(self, frame: Image.Image):
+        """返回 (当前显示画面, 变化掩码, 变化区域)；第一帧的掩码和区域为 None"""
+        current = np.asarray(frame)
+        if self.reference is None or self.reference.shape != current.shape:
+            self.reference = current.copy()
+            return self.reference, None, None
+        
+        mask = changed_mask(self.reference, current, self.threshold)
+        bbox = mask_bbox(mask)
+        if bbox is not None:
+            where = mask[..., None] if current.ndim == 3 else mask
+            np.copyto(self.reference, current, where=where)
+        return self.reference, mask, bbox
+
+
+def quantize_delta_frame(crop: Image.Image, crop_mask: np.ndarray,
+                         size: Tuple[int, int], bbox: Tuple[int, int, int, int]) -> Image.Image:
+    """只量化变化区域，其余像素使用透明色，返回整帧大小的调色板帧"""
+    # 保留一个调色板位置给透明色
+    quantized = crop.quantize(colors=255, method=Image.Quantize.MEDIANCUT)
+    transparent = 255
+    
+    indices = np.full((size[1], size[0]), transparent, dtype=np.uint8)
+    left, top, right, bottom = bbox
+    indices[top:bottom, left:right] = np.where(crop_mask, np.asarray(quantized), transparent)
+    
+    palette = quantized.getpalette()[:255 * 3]
+    palette += [0, 0, 0] * (256 - len(palette) // 3)
+    frame = Image.fromarray(indices, mode='P')
+    frame.putpalette(palette)
+    frame.info['transparency'] = transparent
+    return frame
+
+
+def merge_similar_frames(timed_frames: Iterable[Tuple[Image.Image, float]],
+                         threshold: int = 0) -> Iterator[Tuple[Image.Image, float]]:
+    """合并连续的相同或近似相同的帧，把时长累加到前一帧上
+
+    两帧所有像素的最大差值不超过 threshold 时视为相同（0 表示完全相同）。
+    使用最大差值而不是平均差值，避免小面积的变化被合并掉。
+    """
+    pending = None
+    pending_array = None
+    pending_duration = 0.0
+    
+    for frame, duration in timed_frames:
+        array = np.asarray(frame)
+        if pending is not None and array.shape == pending_array.shape:
+            diff = np.abs(array.astype(np.int16) - pending_array).max()
+            if diff <= threshold:
+                pending_duration += duration
+                continue
+        
+        if pending is not None:
+            yield pending, pending_duration
+        pending, pending_array, pending_duration = frame, array, duration
+    
+    if pending is not None:
+        yield pending, pending_duration
+
+
+def blend_frames(frames: List[Tuple[Image.Image, float]]) -> Image.Image:
+    """按显示时长加权平均多帧；RGBA 帧按预乘透明度混合，避免透明像素的颜色渗入"""
+    first = frames[0][0]
+    total = sum(duration for _, duration in frames)
+    weights = [duration / total if total > 0 else 1 / len(frames) for _, duration in frames]
+    
+    if first.mode == 'RGBA':
+        color = np.zeros(np.asarray(first).shape[:2] + (3,), dtype=np.float32)
+        alpha = np.zeros(color.shape[:2], dtype=np.float32)
+        for (frame, _), weight in zip(frames, weights):
+            array = np.asarray(frame.convert('RGBA'), dtype=np.float32)
+            coverage = array[..., 3] * weight
+            color += array[..., :3] * coverage[..., None]
+            alpha += coverage
+        color /= np.maximum(alpha, 1e-6)[..., None]
+        array = np.dstack([color, alpha])
+    else:
+        array = np.zeros(np.asarray(first).shape, dtype=np.float32)
+        for (frame, _), weight in zip(frames, weights):
+            array += np.asarray(frame.convert(first.mode), dtype=np.float32) * weight
+    
+    return Image.fromarray(np.clip(array + 0.5, 0, 255).astype(np.uint8), first.mode)
+
+
+class TimelineResampler:
+    """按目标帧率重采样源时间轴
+
+    源帧按开始时间落入的 1000/fps 毫秒区间分组，每组输出一帧：
+    nearest 取组内第一帧（丢弃其余帧），blend 按时长加权混合组内所有帧。
+    输出帧的时长为相邻两组在源时间轴上的开始时间之差，总时长与源文件一致。
+    source_fps 为源文件的标称帧率（平均帧时长的倒数），目标帧率不低于它时
+    （误差 RESAMPLE_TOLERANCE 以内）所有帧及其时长原样保留。
+    """
+
+    def __init__(self, fps: float, mode: str = 'nearest', source_fps: Optional[float] = None):
+        if mode not in RESAMPLE_MODES or mode == 'none':
+            raise ValueError(f"不支持的重采样方式: {mode}")
+        self.interval = 1000 / fps
+        self.mode = mode
+        self.passthrough = bool(source_fps) and fps >= source_fps * (1 - RESAMPLE_TOLERANCE)
+        self.time = 0.0
+        self.slot = None
+        self.start = 0.0
+        self.group = []
+    
+    def add(self, frame: Image.Image, duration: float) -> List[Tuple[Image.Image, float]]:
+        """加入一帧源帧，返回已经确定的输出帧 [(帧, 时长)]"""
+        if self.passthrough:
+            start, self.time = self.time, self.time + duration
+            return [(frame, round(self.time) - round(start))]
+        output = []
+        # 加一个小量，避免浮点误差把恰好落在区间边界上的帧算进上一个区间
+        slot = int(self.time / self.interval + 1e-6)
+        if slot != self.slot:
+            output = self._emit()
+            self.slot, self.start = slot, self.time
+        if not self.group or self.mode == 'blend':
+            self.group.append((frame, duration))
+        else:
+            # nearest 只保留组内第一帧，其余帧的时长计入该帧
+            self.group[0] = (self.group[0][0], self.group[0][1] + duration)
+        self.time += duration
+        return output
+    
+    def flush(self) -> List[Tuple[Image.Image, float]]:
+        """输出最后一组"""
+        return self._emit()
+    
+    def _emit(self) -> List[Tuple[Image.Image, float]]:
+        if not self.group:
+            return []
+        # 按累计时间取整，逐帧的取整误差不会累积到总时长上
+        duration = round(self.time) - round(self.start)
+        frame = self.group[0][0] if len(self.group) == 1 else blend_frames(self.group)
+        self.group = []
+        return [(frame, duration)]
+
+
+class ResamplingWriter:
+    """写入器包装：按目标帧率重采样后，把 (帧, 时长) 交给内部写入器"""
+
+    def __init__(self, writer, fps: float, mode: str = 'nearest', source_fps: Optional[float] = None):
+        self.writer = writer
+        self.output_path = writer.output_path
+        self.resampler = TimelineResampler(fps, mode, source_fps)
+    
+    def add(self, frame: Image.Image, duration: Optional[float] = None):
+        if duration is None:
+            # 没有时长信息时无法重采样，按固定帧率直接写入
+            self.writer.add(frame)
+            return
+        for output, output_duration in self.resampler.add(frame, duration):
+            self.writer.add(output, output_duration)
+    
+    def close(self) -> str:
+        for output, output_duration in self.resampler.flush():
+            self.writer.add(output, output_duration)
+        path = self.writer.close()
+        # 输出文件的逐帧时长，供质量检查对齐时间轴
+        self.durations = self.writer.durations
+        return path
+    
+    def abort(self):
+        abort = getattr(self.writer, 'abort', None)
+        if abort is not None:
+            abort()
+
+
+def nominal_fps(durations: List[float]) -> Optional[float]:
+    """源文件的标称帧率：平均帧时长的倒数；没有时长信息时返回 None"""
+    total = sum(durations or ())
+    return 1000 * len(durations) / total if total > 0 else None
+
+
+def prepare_frame_task(frame: Image.Image,
+                       resize: Optional[Tuple[int, int]] = None,
+                       jpg_path: Optional[str] = None,
+                       quality: int = 85,
+                       matte: Tuple[int, int, int] = DEFAULT_MATTE,
+                       keep_alpha: bool = False,
+                       resize_engine: str = 'pil') -> Tuple[Image.Image, dict]:
+    """单帧任务：合成、调整大小，按需保存 JPG（可在子进程中执行）
+
+    frame 可以是帧存储中的 FrameRef，子进程直接映射同一个文件读取像素。
+    返回 (帧, 各步骤耗时)，耗时由主进程汇总。
+    """
+    timings = {}
+    
+    if isinstance(frame, FrameRef):
+        frame = frame.load()
+    
+    start = time.perf_counter()
+    frame = composite_frame(frame, matte, keep_alpha)
+    timings['composite'] = time.perf_counter() - start
+    
+    if resize:
+        start = time.perf_counter()
+        frame = resize_frame(frame, resize, resize_engine)
+        timings['resize'] = time.perf_counter() - start
+    
+    if jpg_path:
+        start = time.perf_counter()
+        # JPG 不支持透明度，保留透明通道时单独合成一份
+        jpg_frame = composite_frame(frame, matte) if frame.mode == 'RGBA' else frame
+        jpg_frame.save(jpg_path, "JPEG", quality=quality, optimize=True)
+        timings['jpg'] = time.perf_counter() - start
+        timings['bytes_written'] = os.path.getsize(jpg_path)
+    
+    return frame, timings
+
+
+class GIFWriter:
+    """增量 GIF 写入器：逐帧量化，只缓存输出尺寸的调色板帧
+
+    palette='global' 时所有帧共享一个调色板：add 只缓存 RGB 帧并采样像素，
+    close 时生成调色板并统一映射，避免调色板闪烁，帧间压缩效果更好。
+    """
+
+    def __init__(self, output_path: str, fps: float = 10, optimize: bool = True,
+                 executor: Optional[Executor] = None,
+                 delta: bool = False, delta_threshold: int = 0,
+                 palette: str = 'frame', dither: str = 'none'):
+        self.output_path = output_path
+        self.duration = int(1000 / fps)
+        self.optimize = optimize
+        # 提供 executor 时量化在进程池中并行执行，close 时按顺序收集
+        self.executor = executor
+        # 增量模式：只编码相对上一帧变化的像素，其余像素透明并保留上一帧（disposal=1）
+        self.delta = DeltaTracker(delta_threshold) if delta else None
+        if palette not in GIF_PALETTE_MODES:
+            raise ValueError(f"不支持的调色板模式: {palette}")
+        if dither not in GIF_DITHER_MODES:
+            raise ValueError(f"不支持的抖动模式: {dither}")
+        self.palette = palette
+        self.dither = dither
+        self.samples = []
+        self.frames = []
+        self.durations = []
+
+    def add(self, frame: Image.Image, duration: Optional[float] = None):
+        """添加一帧；duration 为该帧的显示时长（毫秒），None 表示使用固定帧率"""
+        duration = self.duration if duration is None else int(round(duration))
+        
+        if self.palette == 'global':
+            if self.delta is not None:
+                # 共享调色板下未变化的像素映射结果相同，Pillow 会自动只写出变化区域
+                reference, mask, bbox = self.delta.update(frame)
+                if mask is not None and bbox is None:
+                    self.durations[-1] += duration
+                    return
+                frame = Image.fromarray(reference.copy())
+            self.samples.append(sample_pixels(frame))
+            self.frames.append(frame)
+            self.durations.append(duration)
+            return
+        
+        task, args = quantize_frame, (frame,)
+        
+        if self.delta is not None:
+            _, mask, bbox = self.delta.update(frame)
+            if mask is not None:
+                if bbox is None:
+                    # 画面没有变化，延长上一帧
+                    self.durations[-1] += duration
+                    return
+                left, top, right, bottom = bbox
+                task = quantize_delta_frame
+                args = (frame.crop(bbox), mask[top:bottom, left:right], frame.size, bbox)
+        
+        if self.executor is not None:
+            self.frames.append(self.executor.submit(task, *args))
+        else:
+            self.frames.append(task(*args))
+        self.durations.append(duration)
+
+    def close(self) -> str:
+        if not self.frames:
+            raise Exception("没有可用的帧")
+
+        if self.palette == 'global':
+            palette = build_global_palette(self.samples)
+            tasks = ((frame, palette, self.dither) for frame in self.frames)
+            self.frames = list(ordered_map(map_to_palette, tasks, self.executor))
+            self.samples = []
+        elif self.executor is not None:
+            self.frames = [future.result() for future in self.frames]
+
+        # GIF 帧延迟以 1/100 秒为单位（Pillow 向下取整），按累计时间取整到 10 毫秒，
+        # 避免总时长逐帧缩短；延迟至少 10 毫秒（0 会被浏览器当作 100 毫秒）
+        durations, elapsed, written = [], 0.0, 0
+        for duration in self.durations:
+            elapsed += duration
+            delay = max(10, int(round(elapsed / 10)) * 10 - written)
+            durations.append(delay)
+            written += delay
+        self.durations = durations
+
+        self.frames[0].save(
+            self.output_path,
+            format='GIF',
+            save_all=True,
+            append_images=self.frames[1:],
+            duration=self.durations,
+            loop=0,
+            optimize=self.optimize,
+            disposal=1 if self.delta is not None else 0
+        )
+        # 保留 durations：即输出文件的逐帧时长，供质量检查对齐时间轴
+        self.frames = []
+        return self.output_path
+
+
+class WebPWriter:
+    """增量 WebP 写入器：只缓存输出尺寸的帧（RGB，或保留透明通道的 RGBA）"""
+
+    def __init__(self, output_path: str, quality: int = 80, fps: float = 10,
+                 delta: bool = False, delta_threshold: int = 0, lossless: bool = False):
+        self.output_path = output_path
+        self.quality = quality
+        # 无损模式下 quality 表示压缩努力程度
+        self.lossless = lossless
+        # Pillow 的 WebP 帧间隔单位为毫秒
+        self.duration = int(1000 / fps)
+        # 增量模式：未变化的像素与上一帧完全一致，libwebp 只编码变化区域的子帧
+        self.delta = DeltaTracker(delta_threshold) if delta else None
+        self.frames = []
+        self.durations = []
+
+    def add(self, frame: Image.Image, duration: Optional[float] = None):
+        """添加一帧；duration 为该帧的显示时长（毫秒），None 表示使用固定帧率"""
+        duration = self.duration if duration is None else int(round(duration))
+        
+        if self.delta is not None:
+            reference, mask, bbox = self.delta.update(frame)
+            if mask is not None and bbox is None:
+                # 画面没有变化，延长上一帧
+                self.durations[-1] += duration
+                return
+            frame = Image.fromarray(reference.copy())
+        
+        self.frames.append(frame)
+        self.durations.append(duration)
+
+    def close(self) -> str:
+        if not self.frames:
+            raise Exception("没有可用的帧")
+
+        self.frames[0].save(
+            self.output_path,
+            format='WEBP',
+            save_all=True,
+            append_images=self.frames[1:],
+            duration=self.durations,
+            quality=self.quality,
+            lossless=self.lossless,
+            loop=0,
+            # 增量模式下不插入关键帧，每帧都可以只编码变化区域；
+            # 透明帧的关键帧要重新编码整帧透明通道，代价很高，同样不插入
+            **({'kmin': 0, 'kmax': 0}
+               if self.delta is not None or self.frames[0].mode == 'RGBA' else {})
+        )
+        # 保留 durations：即输出文件的逐帧时长，供质量检查对齐时间轴
+        self.frames = []
+        return self.output_path
+
+
+def rendition_sizes(size: Tuple[int, int], heights: Iterable[int]) -> List[Tuple[int, int]]:
+    """按目标高度计算保持宽高比的尺寸（宽度取偶数），从大到小排列
+
+    不放大：高于原图的高度被跳过，全部跳过时使用原图尺寸；宽度取偶数后也不超过原图宽度。
+    """
+    width, height = size
+    sizes = set()
+    for target_height in heights:
+        if target_height > height:
+            continue
+        target_width = int(target_height * width / height)
+        # 确保宽度是偶数（视频编码要求）；向上取偶数会超过原图宽度时向下取
+        if target_width % 2 != 0:
+            target_width += 1 if target_width < width else -1
+        sizes.add((target_width, target_height))
+    if not sizes:
+        sizes.add((width, height))
+    return sorted(sizes, reverse=True)
+
+
+def check_apng_colors(colors: Optional[int]):
+    """APNG 调色板颜色数必须在 APNG_COLOR_RANGE 内（None 表示不量化）"""
+    low, high = APNG_COLOR_RANGE
+    if colors is not None and not low <= colors <= high:
+        raise ValueError(f"APNG 调色板颜色数必须在 {low}-{high} 之间: {colors}")
+
+
+class AlphaPalette:
+    """APNG 共享的带透明度调色板
+
+    APNG 只有一个全局调色板。调色板只用均匀抽样的最多 APNG_PALETTE_FRAMES 帧、
+    每帧按步长采样的像素生成，采样图像的大小与帧数无关；
+    之后逐帧把颜色映射到最接近的调色板项，已经映射过的颜色跨帧复用。
+    """
+
+    def __init__(self, frames: List[Image.Image], colors: int = 256):
+        indices = sample_indices(len(frames), APNG_PALETTE_FRAMES)
+        pixels = self._normalize(np.concatenate([sample_pixels(frames[i]) for i in indices]))
+        sample = Image.fromarray(pixels.reshape(-1, 1, 4), 'RGBA')
+        sample = sample.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+        self.palette = np.frombuffer(bytes(sample.getpalette('RGBA')), dtype=np.uint8).reshape(-1, 4)
+        # 已映射的颜色（RGBA 按 uint32 打包，升序）及其调色板索引
+        self.known = np.empty(0, dtype=np.uint32)
+        self.known_indices = np.empty(0, dtype=np.uint8)
+        # 上一帧的打包像素和调色板索引
+        self.previous = None
+        self.previous_indices = None
+
+    @staticmethod
+    def _normalize(array: np.ndarray) -> np.ndarray:
+        """完全透明的像素统一为 (0, 0, 0, 0)，不同的隐藏颜色映射到同一个透明项"""
+        array = np.ascontiguousarray(array)
+        transparent = array[..., 3] == 0
+        if transparent.any():
+            array = array.copy()
+            array[transparent] = 0
+        return array
+
+    def _nearest(self, colors: np.ndarray) -> np.ndarray:
+        """打包颜色 → 最接近的调色板索引（RGBA 欧氏距离），分批计算
+
+        |c - p|² = |c|² - 2c·p + |p|²，|c|² 对每个颜色是常数，
+        只需比较 |p|² - 2c·p，用一次矩阵乘法算出整批距离。
+        """
+        rgba = colors.view(np.uint8).reshape(-1, 4).astype(np.float32)
+        palette = self.palette.astype(np.float32)
+        norms = (palette ** 2).sum(axis=1)
+        result = np.empty(len(colors), dtype=np.uint8)
+        for start in range(0, len(colors), PALETTE_MAP_BATCH):
+            distance = norms - 2 * (rgba[start:start + PALETTE_MAP_BATCH] @ palette.T)
+            result[start:start + PALETTE_MAP_BATCH] = distance.argmin(axis=1)
+        return result
+
+    def _learn(self, colors: np.ndarray):
+        """为新颜色计算调色板索引，合并进已映射颜色表"""
+        colors = np.unique(colors)
+        known = np.concatenate([self.known, colors])
+        order = np.argsort(known, kind='stable')
+        self.known = known[order]
+        self.known_indices = np.concatenate([self.known_indices, self._nearest(colors)])[order]
+
+    def _lookup(self, pixels: np.ndarray) -> np.ndarray:
+        """打包像素 → 调色板索引"""
+        position = np.searchsorted(self.known, pixels)
+        missing = position >= len(self.known)
+        missing[~missing] = self.known[position[~missing]] != pixels[~missing]
+        if missing.any():
+            self._learn(pixels[missing])
+            position = np.searchsorted(self.known, pixels)
+        return self.known_indices[position]
+
+    def map(self, frame: Image.Image) -> Image.Image:
+        """把 RGBA 帧映射为使用共享调色板的 P 模式帧
+
+        只处理相对上一帧变化的像素：在已映射颜色表中二分查找，表中没有的颜色才去重并计算最近调色板项；
+        动画的颜色在帧之间大量重复，第一帧之后新颜色很少。
+        """
+        pixels = self._normalize(np.asarray(frame)).view(np.uint32).reshape(-1)
+        if self.previous is not None and self.previous.shape == pixels.shape:
+            # 只查找相对上一帧变化的像素，其余沿用上一帧的索引
+            changed = np.flatnonzero(pixels != self.previous)
+            indices = self.previous_indices.copy()
+            indices[changed] = self._lookup(pixels[changed])
+        else:
+            indices = self._lookup(pixels)
+        self.previous, self.previous_indices = pixels, indices
+
+        output = Image.fromarray(indices.reshape(frame.height, frame.width), 'P')
+        output.putpalette(self.palette.tobytes(), 'RGBA')
+        return output
+
+
+class APNGWriter:
+    """APNG 写入器：保留透明通道重新编码
+
+    Pillow 写出每帧时只保存相对上一帧变化的区域（逐帧裁剪），
+    colors 指定时所有帧共享一个带透明度的调色板，文件更小。
+    """
+
+    def __init__(self, output_path: str, fps: float = 10, colors: Optional[int] = None):
+        check_apng_colors(colors)
+        self.output_path = output_path
+        self.duration = int(1000 / fps)
+        self.colors = colors
+        self.frames = []
+        self.durations = []
+
+    def add(self, frame: Image.Image, duration: Optional[float] = None):
+        """添加一帧；duration 为该帧的显示时长（毫秒），None 表示使用固定帧率"""
+        duration = self.duration if duration is None else int(round(duration))
+        self.frames.append(frame if frame.mode == 'RGBA' else frame.convert('RGBA'))
+        self.durations.append(duration)
+
+    def close(self) -> str:
+        if not self.frames:
+            raise Exception("没有可用的帧")
+
+        frames = self.frames
+        if self.colors:
+            # 逐帧就地替换为调色板帧，RGBA 帧随之释放，不额外保留一份全部帧
+            palette = AlphaPalette(frames, self.colors)
+            for i, frame in enumerate(frames):
+                frames[i] = palette.map(frame)
+
+        # 合并相同的连续帧（量化后也可能出现），使 durations 与文件中的帧一一对应
+        merged, durations = [frames[0]], [self.durations[0]]
+        previous = np.asarray(frames[0])
+        for frame, duration in zip(frames[1:], self.durations[1:]):
+            current = np.asarray(frame)
+            if np.array_equal(current, previous):
+                durations[-1] += duration
+                continue
+            merged.append(frame)
+            durations.append(duration)
+            previous = current
+
+        merged[0].save(
+            self.output_path,
+            format='PNG',
+            save_all=True,
+            append_images=merged[1:],
+            duration=durations,
+            loop=0,
+            # 不清除上一帧、直接覆盖变化区域，逐帧只写出变化的矩形
+            disposal=0,
+            blend=0,
+            optimize=True
+        )
+        # 保留 durations：即输出文件的逐帧时长，供质量检查对齐时间轴
+        self.frames = []
+        self.durations = durations
+        return self.output_path
+
+
+class MP4Writer:
+    """增量 MP4 写入器：每帧直接写入视频，不缓存
+
+    MP4 为固定帧率；传入 duration 时按时间轴重复或跳过帧，保持原始播放时长。
+    """
+
+    def __init__(self, output_path: str, fps: float = 24):
+        self.output_path = output_path
+        self.fps = fps
+        self.size = None
+        self.writer = None
+        self.timeline = 0.0
+        self.written = 0
+
+    def add(self, frame: Image.Image, duration: Optional[float] = None):
+        if duration is None:
+            repeat = 1
+        else:
+            self.timeline += duration
+            repeat = int(round(self.timeline * self.fps / 1000)) - self.written
+        if repeat <= 0:
+            return
+        
+        if self.writer is None:
+            width, height = frame.size
+            # 确保尺寸是偶数（H.264 / yuv420p 要求）；只有视频需要，图像格式保持原尺寸，
+            # 这里把奇数宽高向下裁掉一个像素，不重新缩放
+            self.size = (width - width % 2, height - height % 2)
+            if self.size != frame.size:
+                print(f"📐 视频尺寸调整为偶数: {width}x{height} → {self.size[0]}x{self.size[1]}")
+            self._open()
+
+        if frame.size != self.size:
+            frame = frame.crop((0, 0) + self.size)
+        self._write(frame.convert('RGB'), repeat)
+        self.written += repeat
+
+    def _open(self):
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.writer = cv2.VideoWriter(self.output_path, fourcc, self.fps, self.size)
+
+    def _write(self, frame: Image.Image, repeat: int):
+        # PIL 为 RGB 顺序，OpenCV 需要 BGR
+        image = np.ascontiguousarray(np.asarray(frame)[:, :, ::-1])
+        for _ in range(repeat):
+            self.writer.write(image)
+
+    def _finish(self):
+        self.writer.release()
+
+    def close(self) -> str:
+        if self.writer is None:
+            raise Exception("没有可用的帧")
+
+        self._finish()
+        self.writer = None
+        # 输出文件的逐帧时长，供质量检查对齐时间轴
+        self.durations = [1000 / self.fps] * self.written
+        return self.output_path
+
+
+class FFmpegWriter(MP4Writer):
+    """ffmpeg 视频写入器：把原始 RGB 帧通过管道直接送入 ffmpeg 子进程，不产生临时文件
+
+    支持 H.264 (libx264, MP4) 和 VP9 (libvpx-vp9, WebM)，
+    CRF、preset、像素格式、faststart 和编码线程数都会传给编码器。
+    """
+
+    def __init__(self, output_path: str, fps: float = 24, codec: str = 'h264',
+                 crf: int = 23, preset: str = 'medium', pix_fmt: str = 'yuv420p',
+                 faststart: bool = True, threads: int = 0):
+        super().__init__(output_path, fps)
+        if codec not in VIDEO_CODECS:
+            raise ValueError(f"不支持的视频编码: {codec}")
+        self.codec = codec
+        self.crf = crf
+        self.preset = preset
+        self.pix_fmt = pix_fmt
+        self.faststart = faststart
+        self.threads = threads
+
+    def command(self) -> List[str]:
+        width, height = self.size
+        command = [
+            FFMPEG, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+            '-s', f"{width}x{height}", '-r', str(self.fps),
+            '-i', '-',
+            '-an',
+            '-c:v', VIDEO_CODECS[self.codec]['encoder'],
+            '-crf', str(self.crf),
+            '-pix_fmt', self.pix_fmt,
+            '-threads', str(self.threads),
+        ]
+        if self.codec == 'h264':
+            command += ['-preset', self.preset]
+            if self.faststart:
+                # moov 放在文件开头，浏览器无需下载完整文件即可开始播放
+                command += ['-movflags', '+faststart']
+        else:
+            # VP9 恒定质量模式需要 -b:v 0；preset 映射为 cpu-used
+            command += ['-b:v', '0', '-deadline', 'good',
+                        '-cpu-used', str(VP9_CPU_USED.get(self.preset, 2)), '-row-mt', '1']
+        return command + [str(self.output_path)]
+
+    def _open(self):
+        self.writer = subprocess.Popen(self.command(), stdin=subprocess.PIPE,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def _write(self, frame: Image.Image, repeat: int):
+        data = frame.tobytes()
+        writer = self.writer
+        try:
+            for _ in range(repeat):
+                writer.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            # 已被 abort() 结束时直接返回；否则 ffmpeg 已退出，报告错误信息
+            if self.writer is not None:
+                self._finish()
+
+    def abort(self):
+        """结束 ffmpeg 子进程，删除未完成的输出（可以在编码线程阻塞于写管道时调用）"""
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.kill()
+            writer.communicate()
+            Path(self.output_path).unlink(missing_ok=True)
+
+    def _finish(self):
+        _, stderr = self.writer.communicate()
+        if self.writer.returncode != 0:
+            raise Exception(f"ffmpeg 编码失败: {stderr.decode('utf-8', 'replace').strip()}")
+
+
+def create_video_writer(output_path: str, fps: float = 24, backend: str = 'auto',
+                        codec: str = 'h264', crf: int = 23, preset: str = 'medium',
+                        pix_fmt: str = 'yuv420p', faststart: bool = True,
+                        threads: int = 0) -> MP4Writer:
+    """按后端创建视频写入器：auto 在找到 ffmpeg 时使用 ffmpeg，否则回退到 OpenCV (mp4v)"""
+    if resolve_video_backend(backend, codec) == 'ffmpeg':
+        return create_writer('ffmpeg', output_path, fps=fps, codec=codec, crf=crf, preset=preset,
+                             pix_fmt=pix_fmt, faststart=faststart, threads=threads)
+    return create_writer('opencv', output_path, fps=fps)
+
+
+def resolve_video_backend(backend: str = 'auto', codec: str = 'h264') -> str:
+    """确定实际使用的视频后端；VP9 只能通过 ffmpeg 编码"""
+    if backend not in VIDEO_BACKENDS:
+        raise ValueError(f"不支持的视频后端: {backend}")
+    if backend == 'auto':
+        backend = 'ffmpeg' if FFMPEG else 'opencv'
+    if backend == 'ffmpeg' and not FFMPEG:
+        raise Exception("未找到 ffmpeg，请安装 ffmpeg 或使用 --video-backend opencv")
+    if backend == 'opencv' and codec != 'h264':
+        raise Exception(f"OpenCV 后端不支持 {codec}，请安装 ffmpeg")
+    return backend
+
+
+def gif_modules(options: dict) -> Tuple[str, ...]:
+    """GIF 的依赖：增量编码、共享调色板和抖动使用 NumPy，逐帧独立量化只需要 Pillow"""
+    if options.get('delta') or options.get('palette', 'frame') != 'frame':
+        return ('numpy',)
+    return ()
+
+
+def webp_modules(options: dict) -> Tuple[str, ...]:
+    """WebP 的依赖：增量编码使用 NumPy，普通编码只需要 Pillow"""
+    return ('numpy',) if options.get('delta') else ()
+
+
+# 编码器注册表：名称 → (写入器类, 必需的第三方模块)
+# 必需模块也可以是按写入器参数返回模块列表的函数，只有用到的编码路径才要求安装对应的库。
+# 创建写入器时就检查依赖，缺少时立即失败，而不是编码到一半才抛出 ImportError；
+# NumPy / OpenCV 在第一次使用时才导入，因此只输出 WebP 或使用 ffmpeg 后端时不会加载 OpenCV
+ENCODERS = {
+    'gif': (GIFWriter, gif_modules),
+    'webp': (WebPWriter, webp_modules),
+    'apng': (APNGWriter, ('numpy',)),
+    'ffmpeg': (FFmpegWriter, ()),
+    'opencv': (MP4Writer, ('numpy', 'cv2')),
+}
+
+
+def register_encoder(name: str, writer_class, modules: Iterable[str] = ()):
+    """注册编码器；写入器需提供 add(frame, duration)、close() 和 close 后的 durations
+
+    modules 为必需的模块名，或接收写入器关键字参数、返回模块名的函数。
+    """
+    ENCODERS[name] = (writer_class, modules if callable(modules) else tuple(modules))
+
+
+def create_writer(name: str, *args, **kwargs):
+    """按名称创建写入器；缺少依赖时抛出带安装提示的 MissingDependency"""
+    if name not in ENCODERS:
+        raise ValueError(f"未知的编码器: {name}")
+    writer_class, modules = ENCODERS[name]
+    require(*(modules(kwargs) if callable(modules) else modules))
+    return writer_class(*args, **kwargs)
+
+
+class EncoderThread(threading.Thread):
+    """在独立线程中驱动一个写入器
+
+    帧通过有界队列传入，多个编码器可以同时工作；
+    elapsed 记录该编码器实际消耗的时间（add + close）。
+    """
+
+    _STOP = object()
+
+    def __init__(self, name: str, writer, maxsize: int = 8):
+        super().__init__(name=f"encoder-{name}", daemon=True)
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.elapsed = 0.0
+        self.result = None
+        self.error = None
+
+    def put(self, frame: Image.Image, duration: Optional[float] = None):
+        self.queue.put((frame, duration))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if self.error is not None:
+                # 出错后继续取走队列中的帧，避免生产者阻塞
+                if item is self._STOP:
+                    return
+                continue
+            
+            start = time.perf_counter()
+            try:
+                if item is self._STOP:
+                    self.result = self.writer.close()
+                else:
+                    self.writer.add(*item)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.elapsed += time.perf_counter() - start
+            
+            if item is self._STOP:
+                return
+
+    def finish(self) -> str:
+        """发送结束信号并等待编码完成，返回输出文件路径"""
+        self.queue.put(self._STOP)
+        self.join()
+        self._release()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def cancel(self):
+        """放弃编码：丢弃剩余的帧，结束 ffmpeg 等子进程并删除未完成的输出"""
+        if self.error is None:
+            self.error = Exception("编码已取消")
+        # 先结束子进程，编码线程阻塞在写管道上时也能退出；线程结束后再清理一次
+        self._release()
+        self.queue.put(self._STOP)
+        self.join()
+        self._release()
+
+    def _release(self):
+        """写入器持有外部资源（如 ffmpeg 子进程）时一并释放；已正常关闭时不做任何事"""
+        abort = getattr(self.writer, 'abort', None)
+        if abort is not None:
+            abort()
+
+
+def finish_encoders(encoders: dict) -> dict:
+    """结束所有编码器，返回 {名称: 输出文件路径}
+
+    某个编码器出错后，其余编码器改为取消（不再写出文件），
+    所有编码器线程和子进程都清理完毕后再抛出第一个错误。
+    """
+    output_files = {}
+    errors = []
+    for name, encoder in encoders.items():
+        try:
+            if errors:
+                encoder.cancel()
+            else:
+                output_files[name] = encoder.finish()
+        except Exception as e:
+            errors.append(e)
+    if errors:
+        for error in errors[1:]:
+            print(f"⚠️  编码器清理时出错: {error}")
+        raise errors[0]
+    return output_files
+
+
+def cancel_encoders(encoders: dict):
+    """取消所有编码器；单个编码器清理失败不影响其余编码器"""
+    for encoder in encoders.values():
+        try:
+            encoder.cancel()
+        except Exception as e:
+            print(f"⚠️  编码器清理时出错: {e}")
+
 
 class APNGProcessor:
-    def __init__(self, input_file: str, output_dir: str = "output"):
+    def __init__(self, input_file: str, output_dir: str = "output", keep_frames: bool = False,
+                 workers: Optional[int] = None, cache: Optional[BuildCache] = None,
+                 mmap_frames: bool = False, decoder: str = 'auto', resize_engine: str = 'pil'):
         self.input_file = Path(input_file)
         self.output_dir = Path(output_dir)
         self.frames_dir = self.output_dir / "frames"
         self.jpg_frames_dir = self.output_dir / "jpg_frames"
+        # 是否把中间帧（PNG/JPG）写入磁盘，默认只在内存中传递
+        self.keep_frames = keep_frames
+        # 逐帧处理的并行进程数，默认使用全部 CPU 核心
+        self.workers = workers or os.cpu_count() or 1
+        # 构建缓存，None 表示不使用缓存
+        self.cache = cache
+        # 各阶段耗时和读写字节数
+        self.stats = PipelineStats()
+        # 是否把需要保留的帧放入内存映射帧存储（临时文件位于输出目录），而不是 Python 堆
+        self.mmap_frames = mmap_frames
+        # 帧解码器，见 DECODERS；两种解码器输出的帧逐像素一致
+        if decoder not in DECODERS:
+            raise ValueError(f"不支持的解码器: {decoder}")
+        if decoder == 'native':
+            # 原生解码器用 NumPy 合成画布，缺少时在开始解码前失败
+            require('numpy')
+        self.decoder = decoder
+        # 缩放引擎，见 resizing.RESIZE_ENGINES；auto 在创建时确定，参与缓存键
+        self.resize_engine = resolve_engine(resize_engine)
         
         # 创建输出目录
         self.output_dir.mkdir(exist_ok=True)
-        self.frames_dir.mkdir(exist_ok=True)
-        self.jpg_frames_dir.mkdir(exist_ok=True)
+        if keep_frames:
+            self.frames_dir.mkdir(exist_ok=True)
+            self.jpg_frames_dir.mkdir(exist_ok=True)
         
         self.frames = []
+        self.prepared_frames = []
         self.frame_durations = []
         
     def analyze_apng(self) -> dict:
@@ -49,6 +1085,12 @@ class APNGProcessor:
             raise FileNotFoundError(f"文件不存在: {self.input_file}")
         
         try:
+            # APNG 直接解析块结构，不解码任何帧
+            if is_png(self.input_file):
+                return parse_apng(self.input_file)
+            
+            # 其他格式（如 GIF）回退到 Pillow，需要读取全部帧
+            self.stats.bytes_read += self.input_file.stat().st_size
             with Image.open(self.input_file) as img:
                 info = {
                     'format': img.format,
@@ -63,7 +1105,10 @@ class APNGProcessor:
                 if info['is_animated']:
                     durations = []
                     for frame in ImageSequence.Iterator(img):
-                        duration = frame.info.get('duration', 100)  # 默认100ms
+                        # WebP 的帧时长在 load() 之后才写入 info
+                        frame.load()
+                        # 没有时长或时长为 0 时按 100ms（与浏览器一致）
+                        duration = frame.info.get('duration') or 100
                         durations.append(duration)
                     info['frame_durations'] = durations
                     info['total_duration'] = sum(durations)
@@ -74,194 +1119,304 @@ class APNGProcessor:
         except Exception as e:
             raise Exception(f"无法分析文件: {e}")
     
+    def iter_frames(self) -> Iterator[Image.Image]:
+        """逐帧解码动图，同一时间只持有当前帧"""
+        self.frame_durations = []
+        self.stats.bytes_read += self.input_file.stat().st_size
+
+        decoder = self._native_decoder()
+        if decoder is not None:
+            yield from self._timed_frames(iter(decoder))
+            return
+
+        with Image.open(self.input_file) as img:
+            if not getattr(img, 'is_animated', False):
+                print("⚠️  这不是一个动图文件")
+                self.frame_durations.append(100)
+                yield img.copy()
+                return
+
+            frame_count = getattr(img, 'n_frames', 1)
+            frames = (img.seek(i) or img.copy() for i in range(frame_count))
+            yield from self._timed_frames(frames)
+
+    def _native_decoder(self) -> Optional[APNGDecoder]:
+        """按 decoder 设置返回原生 APNG 解码器；不使用或文件不支持时返回 None（使用 Pillow）"""
+        if self.decoder == 'pillow' or not is_png(self.input_file):
+            return None
+        # 原生解码器的优势在于多线程并行解压，单核机器上默认仍使用 Pillow；
+        # 它依赖 NumPy，未安装时 auto 也使用 Pillow，只输出 GIF/WebP 时不需要 NumPy
+        if self.decoder == 'auto' and ((os.cpu_count() or 1) < 2 or not has_module('numpy')):
+            return None
+
+        try:
+            decoder = APNGDecoder(self.input_file, threads=self.workers)
+        except (ValueError, struct.error):
+            decoder = None
+        if decoder is not None and decoder.supported:
+            return decoder
+        if self.decoder == 'native':
+            print("⚠️  原生解码器不支持该文件（仅支持默认图像为第一帧的 8 位 RGB/RGBA/调色板 APNG），使用 Pillow 解码")
+        return None
+
+    def _timed_frames(self, frames: Iterator[Image.Image]) -> Iterator[Image.Image]:
+        """统计解码耗时，记录帧时长，按需保存原始帧"""
+        for i in range(sys.maxsize):
+            start = time.perf_counter()
+            frame = next(frames, None)
+            if frame is None:
+                return
+            self.stats.add('decode', time.perf_counter() - start)
+
+            # 获取帧持续时间；没有时长或时长为 0 时按 100ms（与浏览器一致）
+            duration = frame.info.get('duration') or 100
+            self.frame_durations.append(duration)
+
+            # 保存原始帧
+            if self.keep_frames:
+                frame_path = self.frames_dir / f"frame_{i:04d}.png"
+                with self.stats.measure('save_frames'):
+                    frame.save(frame_path, "PNG")
+                self.stats.bytes_written += frame_path.stat().st_size
+
+            yield frame
+
     def extract_frames(self) -> List[Image.Image]:
         """提取所有帧"""
         print("📸 提取动图帧...")
         
-        frames = []
-        durations = []
-        
         try:
-            with Image.open(self.input_file) as img:
-                if not getattr(img, 'is_animated', False):
-                    print("⚠️  这不是一个动图文件")
-                    frames.append(img.copy())
-                    durations.append(100)
-                else:
-                    frame_count = getattr(img, 'n_frames', 1)
-                    
-                    for i in tqdm(range(frame_count), desc="提取帧"):
-                        img.seek(i)
-                        frame = img.copy()
-                        frames.append(frame)
-                        
-                        # 获取帧持续时间
-                        duration = frame.info.get('duration', 100)
-                        durations.append(duration)
-                        
-                        # 保存原始帧
-                        frame_path = self.frames_dir / f"frame_{i:04d}.png"
-                        frame.save(frame_path, "PNG")
-                
-                self.frames = frames
-                self.frame_durations = durations
-                
-                print(f"✅ 提取了 {len(frames)} 帧")
-                return frames
-                
+            self.release_frames()
+            frames = self._collect_frames(progress(self.iter_frames(), desc="提取帧"), self._frame_count())
+            self.frames = frames
+            
+            print(f"✅ 提取了 {len(frames)} 帧")
+            return frames
+            
         except Exception as e:
             raise Exception(f"提取帧失败: {e}")
     
-    def convert_to_jpg(self, quality: int = 85, resize: Optional[Tuple[int, int]] = None) -> List[str]:
+    def _frame_count(self) -> int:
+        with Image.open(self.input_file) as img:
+            return getattr(img, 'n_frames', 1)
+    
+    def _collect_frames(self, frames: Iterable[Image.Image], count: int,
+                        mode: Optional[str] = None):
+        """收集帧：默认返回列表；开启 mmap_frames 时写入帧存储
+
+        帧存储在拿到第一帧后按其尺寸创建；mode 为 None 时按第一帧是否带透明通道选择 RGB/RGBA。
+        """
+        if not self.mmap_frames:
+            return list(frames)
+        
+        store = None
+        for frame in frames:
+            if store is None:
+                store_mode = mode or ('RGB' if frame.mode in ('RGB', 'L') else 'RGBA')
+                store = FrameStore(count, frame.size, store_mode, directory=str(self.output_dir))
+            store.append(frame)
+        if store is None:
+            return []
+        store.flush()
+        return store
+    
+    def release_frames(self):
+        """释放已保存的帧（删除帧存储的临时文件）"""
+        for frames in (self.frames, self.prepared_frames):
+            if isinstance(frames, FrameStore):
+                frames.close()
+        self.frames = []
+        self.prepared_frames = []
+    
+    def _source_frames(self) -> Iterable:
+        """逐帧任务的输入：帧存储中的帧以 FrameRef 传递，子进程不需要接收像素数据"""
+        if isinstance(self.frames, FrameStore):
+            return (self.frames.ref(i) for i in range(len(self.frames)))
+        return self.frames
+    
+    @staticmethod
+    def _prepare_frame(frame: Image.Image, resize: Optional[Tuple[int, int]] = None,
+                       matte: Tuple[int, int, int] = DEFAULT_MATTE,
+                       keep_alpha: bool = False, resize_engine: str = 'pil') -> Image.Image:
+        """合成 matte 背景（默认白色）并调整大小，返回 RGB 帧；keep_alpha 时返回 RGBA 帧"""
+        frame = composite_frame(frame, matte, keep_alpha)
+        
+        # 调整大小
+        return resize_frame(frame, resize, resize_engine)
+    
+    @staticmethod
+    def _resize_target(resize: Optional[Tuple[int, int]]) -> Optional[Tuple[int, int]]:
+        """缩放目标尺寸：GIF/WebP/APNG 使用请求的尺寸，视频写入器自行把奇数宽高裁剪为偶数"""
+        if not resize:
+            return None
+        return tuple(resize)
+    
+    def executor(self):
+        """按 workers 创建进程池；单进程时返回空上下文（串行执行）"""
+        if self.workers > 1:
+            # 按需导入：单进程运行时不加载 multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            return ProcessPoolExecutor(max_workers=self.workers)
+        return nullcontext(None)
+    
+    def iter_prepared_frames(self,
+                             quality: int = 85,
+                             resize: Optional[Tuple[int, int]] = None,
+                             executor: Optional[Executor] = None,
+                             matte: Tuple[int, int, int] = DEFAULT_MATTE,
+                             keep_alpha: bool = False) -> Iterator[Image.Image]:
+        """流式管线：解码 → 合成 → 调整大小，逐帧产出 RGB 帧（keep_alpha 时为 RGBA 帧）
+
+        只有开启 keep_frames 时才把 JPG 帧写入磁盘，编码器直接使用内存中的帧。
+        提供 executor 时逐帧任务并行执行，输出顺序不变。
+        """
+        resize = self._resize_target(resize)
+        tasks = (
+            (frame, resize,
+             str(self.jpg_frames_dir / f"frame_{i:04d}.jpg") if self.keep_frames else None,
+             quality, matte, keep_alpha, self.resize_engine)
+            for i, frame in enumerate(self.iter_frames())
+        )
+        yield from self._run_prepare_tasks(tasks, executor)
+    
+    def _run_prepare_tasks(self, tasks: Iterable[tuple], executor: Optional[Executor]) -> Iterator[Image.Image]:
+        """执行逐帧任务并汇总各步骤耗时"""
+        for frame, timings in ordered_map(prepare_frame_task, tasks, executor, self.workers * 2):
+            self.stats.bytes_written += timings.pop('bytes_written', 0)
+            for name, seconds in timings.items():
+                self.stats.add(name, seconds)
+            yield frame
+    
+    def prepare_frames(self, resize: Optional[Tuple[int, int]] = None,
+                       matte: Tuple[int, int, int] = DEFAULT_MATTE,
+                       keep_alpha: bool = False) -> List[Image.Image]:
+        """在内存中准备编码用的帧（合成 matte 背景并调整大小，keep_alpha 时保留透明通道）"""
+        print("🖼️  准备编码帧...")
+        
+        if not self.frames:
+            raise Exception("没有可用的帧，请先提取帧")
+        
+        resize = self._resize_target(resize)
+        with self.executor() as executor:
+            tasks = ((frame, resize, None, 85, matte, keep_alpha, self.resize_engine)
+                     for frame in self._source_frames())
+            self.prepared_frames = self._collect_frames(progress(
+                self._run_prepare_tasks(tasks, executor),
+                total=len(self.frames), desc="准备帧"
+            ), len(self.frames), 'RGBA' if keep_alpha else 'RGB')
+        
+        print(f"✅ 准备了 {len(self.prepared_frames)} 帧")
+        return self.prepared_frames
+    
+    def convert_to_jpg(self, quality: int = 85, resize: Optional[Tuple[int, int]] = None,
+                       matte: Tuple[int, int, int] = DEFAULT_MATTE) -> List[str]:
         """将帧转换为 JPG 格式"""
         print("🖼️  转换为 JPG 格式...")
         
         if not self.frames:
             raise Exception("没有可用的帧，请先提取帧")
         
-        jpg_paths = []
-        
-        for i, frame in enumerate(tqdm(self.frames, desc="转换JPG")):
-            # 转换为 RGB 模式（JPG 不支持透明度）
-            if frame.mode in ('RGBA', 'LA', 'P'):
-                # 创建白色背景
-                background = Image.new('RGB', frame.size, (255, 255, 255))
-                if frame.mode == 'P':
-                    frame = frame.convert('RGBA')
-                background.paste(frame, mask=frame.split()[-1] if frame.mode == 'RGBA' else None)
-                frame = background
-            elif frame.mode != 'RGB':
-                frame = frame.convert('RGB')
-            
-            # 调整大小
-            if resize:
-                frame = frame.resize(resize, Image.Resampling.LANCZOS)
-            
-            # 保存为 JPG
-            jpg_path = self.jpg_frames_dir / f"frame_{i:04d}.jpg"
-            frame.save(jpg_path, "JPEG", quality=quality, optimize=True)
-            jpg_paths.append(str(jpg_path))
+        self.jpg_frames_dir.mkdir(exist_ok=True)
+        jpg_paths = [str(self.jpg_frames_dir / f"frame_{i:04d}.jpg") for i in range(len(self.frames))]
+        
+        resize = self._resize_target(resize)
+        with self.executor() as executor:
+            tasks = ((frame, resize, jpg_path, quality, matte, False, self.resize_engine)
+                     for frame, jpg_path in zip(self._source_frames(), jpg_paths))
+            # 编码器直接使用内存中的帧，无需重新读取 JPG
+            self.prepared_frames = self._collect_frames(progress(
+                self._run_prepare_tasks(tasks, executor),
+                total=len(self.frames), desc="转换JPG"
+            ), len(self.frames), 'RGB')
         
         print(f"✅ 转换了 {len(jpg_paths)} 个 JPG 文件")
         return jpg_paths
     
-    def create_gif(self, output_path: str, fps: float = 10, optimize: bool = True) -> str:
+    def _get_prepared_frames(self, frames: Optional[List[Image.Image]] = None) -> List[Image.Image]:
+        """获取编码用的 RGB 帧：优先使用内存中的帧，否则读取已有的 JPG 帧文件"""
+        if frames is not None:
+            return frames
+        if self.prepared_frames:
+            return self.prepared_frames
+        
+        jpg_paths = sorted(self.jpg_frames_dir.glob("*.jpg"))
+        if not jpg_paths:
+            raise Exception("没有可用的帧，请先调用 prepare_frames 或 convert_to_jpg")
+        
+        return [Image.open(jpg_path).convert('RGB') for jpg_path in progress(jpg_paths, desc="读取JPG")]
+    
+    def create_gif(self, output_path: str, fps: float = 10, optimize: bool = True,
+                   matte: Tuple[int, int, int] = DEFAULT_MATTE, resample: str = 'nearest') -> str:
         """创建 GIF 动图"""
         print("🎬 创建 GIF 动图...")
         
         if not self.frames:
             raise Exception("没有可用的帧")
         
-        # 计算帧间隔（毫秒）
-        duration = int(1000 / fps)
-        
-        # 优化调色板
-        frames_for_gif = []
-        for frame in self.frames:
-            # 确保所有帧都是 RGB 模式
-            if frame.mode in ('RGBA', 'LA'):
-                # 创建白色背景处理透明度
-                background = Image.new('RGB', frame.size, (255, 255, 255))
-                if frame.mode == 'RGBA':
-                    background.paste(frame, mask=frame.split()[-1])
-                else:
-                    background.paste(frame)
-                frame = background
-            elif frame.mode == 'P':
-                # 调色板模式直接转换为 RGB
-                frame = frame.convert('RGB')
-            elif frame.mode != 'RGB':
-                frame = frame.convert('RGB')
-
-            # 转换为调色板模式以减小文件大小
-            try:
-                frame = frame.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
-            except Exception:
-                # 如果量化失败，保持 RGB 模式
-                pass
-            frames_for_gif.append(frame)
-        
-        # 保存 GIF
-        frames_for_gif[0].save(
-            output_path,
-            format='GIF',
-            save_all=True,
-            append_images=frames_for_gif[1:],
-            duration=duration,
-            loop=0,
-            optimize=optimize
-        )
+        with self.executor() as executor:
+            writer = self._resampling(create_writer('gif', output_path, fps=fps, optimize=optimize,
+                                                    executor=executor), fps, resample)
+            self._add_gif_frames(writer, matte)
+            
+            # 保存 GIF
+            writer.close()
         
         file_size = Path(output_path).stat().st_size / (1024 * 1024)
         print(f"✅ GIF 创建完成: {output_path} ({file_size:.2f} MB)")
         return output_path
     
-    def create_webp(self, output_path: str, quality: int = 80, fps: float = 10) -> str:
+    def _add_gif_frames(self, writer: GIFWriter, matte: Tuple[int, int, int] = DEFAULT_MATTE):
+        """把原始帧合成为 RGB 后交给 GIF 写入器（量化由写入器完成）"""
+        for frame, duration in self._timed(self.frames):
+            writer.add(composite_frame(frame, matte), duration)
+    
+    def _resampling(self, writer, fps: float, resample: str):
+        """有源帧时长时用重采样写入器包装 writer"""
+        if resample == 'none' or not self.frame_durations:
+            return writer
+        return ResamplingWriter(writer, fps, resample, nominal_fps(self.frame_durations))
+    
+    def _timed(self, frames: Iterable[Image.Image]) -> Iterator[Tuple[Image.Image, Optional[float]]]:
+        """为帧配上源帧时长；帧数与 frame_durations 不一致时不提供时长"""
+        if len(frames) != len(self.frame_durations):
+            return ((frame, None) for frame in frames)
+        return zip(frames, self.frame_durations)
+    
+    def create_webp(self, output_path: str, quality: int = 80, fps: float = 10,
+                    frames: Optional[List[Image.Image]] = None, resample: str = 'nearest') -> str:
         """创建 WebP 动图"""
         print("🌐 创建 WebP 动图...")
         
-        jpg_paths = list(self.jpg_frames_dir.glob("*.jpg"))
-        if not jpg_paths:
-            raise Exception("没有找到 JPG 帧文件")
-        
-        # 按文件名排序
-        jpg_paths.sort()
-        
-        # 读取图片
-        images = []
-        for jpg_path in tqdm(jpg_paths, desc="读取JPG"):
-            img = imageio.imread(jpg_path)
-            images.append(img)
-        
-        # 计算帧间隔（秒）
-        duration = 1.0 / fps
+        writer = self._resampling(create_writer('webp', output_path, quality=quality, fps=fps),
+                                  fps, resample)
+        for frame, duration in self._timed(self._get_prepared_frames(frames)):
+            writer.add(frame, duration)
         
         # 保存为 WebP
-        imageio.mimsave(
-            output_path,
-            images,
-            format='WEBP',
-            duration=duration,
-            quality=quality,
-            loop=0
-        )
+        writer.close()
         
         file_size = Path(output_path).stat().st_size / (1024 * 1024)
         print(f"✅ WebP 创建完成: {output_path} ({file_size:.2f} MB)")
         return output_path
     
-    def create_mp4(self, output_path: str, fps: float = 24, crf: int = 23) -> str:
-        """创建 MP4 视频"""
+    def create_mp4(self, output_path: str, fps: float = 24, crf: int = 23,
+                   frames: Optional[List[Image.Image]] = None,
+                   backend: str = 'auto', codec: str = 'h264', preset: str = 'medium',
+                   pix_fmt: str = 'yuv420p', faststart: bool = True, threads: int = 0,
+                   resample: str = 'nearest') -> str:
+        """创建视频（ffmpeg 可用时为 H.264/VP9，否则回退到 OpenCV mp4v）"""
         print("🎥 创建 MP4 视频...")
         
-        jpg_paths = list(self.jpg_frames_dir.glob("*.jpg"))
-        if not jpg_paths:
-            raise Exception("没有找到 JPG 帧文件")
-        
-        # 按文件名排序
-        jpg_paths.sort()
-        
-        # 读取第一张图片获取尺寸
-        first_img = cv2.imread(str(jpg_paths[0]))
-        height, width, _ = first_img.shape
+        # 写入帧（奇数尺寸由写入器裁剪为偶数）
+        writer = create_video_writer(output_path, fps=fps, backend=backend, codec=codec, crf=crf,
+                                     preset=preset, pix_fmt=pix_fmt, faststart=faststart,
+                                     threads=threads)
+        writer = self._resampling(writer, fps, resample)
+        frames = self._get_prepared_frames(frames)
+        for frame, duration in progress(self._timed(frames), total=len(frames), desc="写入MP4"):
+            writer.add(frame, duration)
         
-        # 确保尺寸是偶数（MP4 要求）
-        if width % 2 != 0:
-            width -= 1
-        if height % 2 != 0:
-            height -= 1
-        
-        # 创建视频写入器
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-        
-        # 写入帧
-        for jpg_path in tqdm(jpg_paths, desc="写入MP4"):
-            img = cv2.imread(str(jpg_path))
-            img = cv2.resize(img, (width, height))
-            out.write(img)
-        
-        out.release()
+        writer.close()
         
         file_size = Path(output_path).stat().st_size / (1024 * 1024)
         print(f"✅ MP4 创建完成: {output_path} ({file_size:.2f} MB)")
@@ -272,57 +1427,296 @@ class APNGProcessor:
                    resize: Optional[Tuple[int, int]] = None,
                    gif_fps: float = 10,
                    webp_fps: float = 15,
-                   mp4_fps: float = 24) -> dict:
-        """完整处理流程"""
+                   mp4_fps: float = 24,
+                   variable_fps: bool = False,
+                   merge_threshold: int = 0,
+                   resample: str = 'nearest',
+                   delta_frames: bool = False,
+                   delta_threshold: int = 0,
+                   gif_palette: str = 'frame',
+                   gif_dither: str = 'none',
+                   metric_frames: int = REPORT_SAMPLE_FRAMES,
+                   matte: Tuple[int, int, int] = DEFAULT_MATTE,
+                   alpha_outputs: bool = False,
+                   alpha_lossless: bool = False,
+                   apng_colors: Optional[int] = None,
+                   video_backend: str = 'auto',
+                   video_codec: str = 'h264',
+                   crf: int = 23,
+                   video_preset: str = 'medium',
+                   pix_fmt: str = 'yuv420p',
+                   faststart: bool = True,
+                   video_threads: int = 0,
+                   poster: Optional[str] = None) -> dict:
+        """完整处理流程
+
+        variable_fps 为 True 时 GIF/WebP 使用源文件的逐帧时长（忽略 gif_fps/webp_fps），
+        并合并最大像素差不超过 merge_threshold 的连续帧；MP4 按时间轴重复帧以保持时长。
+        否则按 resample 把源时间轴重采样到各格式的目标帧率（nearest 丢帧、blend 混合），
+        输出时长与源文件一致；resample='none' 时每个源帧按目标帧率的固定时长写入。
+        delta_frames 为 True 时 GIF/WebP 只编码相对上一帧变化的区域，
+        像素差不超过 delta_threshold 视为未变化。
+        gif_palette='global' 时 GIF 所有帧共享一个调色板，gif_dither 选择抖动方式。
+        metric_frames 为质量检查抽样的源帧数，0 表示不计算 SSIM/PSNR。
+        matte 为合成透明区域使用的背景色。
+        alpha_outputs 为 True 时额外输出保留透明通道的 WebP（alpha_lossless 为无损）
+        和 APNG（apng_colors 指定时量化到共享调色板）。
+        video_backend 为 auto 时有 ffmpeg 就用 ffmpeg 按 video_codec/crf/video_preset 等参数编码，
+        否则回退到 OpenCV (mp4v)；VP9 输出为 compressed.webm。
+        poster 为封面帧策略（见 POSTER_STRATEGIES），指定时额外输出 poster.webp / poster.jpg、
+        内联占位图和 poster.json 清单。
+        """
         print("🚀 开始完整处理流程...")
         start_time = time.time()
         
         results = {}
         
+        # 质量检查需要 OpenCV，未安装时跳过而不是在编码完成后失败
+        if metric_frames > 0 and not has_module('cv2'):
+            print("⚠️  未安装 opencv-python，跳过质量检查")
+            metric_frames = 0
+        
+        # 完整的处理参数，参与缓存键计算
+        options = {
+            'jpg_quality': jpg_quality,
+            'resize': resize,
+            'resize_engine': self.resize_engine,
+            'gif_fps': gif_fps,
+            'webp_fps': webp_fps,
+            'mp4_fps': mp4_fps,
+            'variable_fps': variable_fps,
+            'merge_threshold': merge_threshold,
+            'resample': resample,
+            'delta_frames': delta_frames,
+            'delta_threshold': delta_threshold,
+            'gif_palette': gif_palette,
+            'gif_dither': gif_dither,
+            'metric_frames': metric_frames,
+            'matte': list(matte),
+            'alpha_outputs': alpha_outputs,
+            'alpha_lossless': alpha_lossless,
+            'apng_colors': apng_colors,
+            # 实际使用的后端参与缓存键，安装 ffmpeg 后不会复用 OpenCV 的输出
+            'video_backend': resolve_video_backend(video_backend, video_codec),
+            'video_codec': video_codec,
+            'crf': crf,
+            'video_preset': video_preset,
+            'pix_fmt': pix_fmt,
+            'faststart': faststart,
+            'video_threads': video_threads,
+            'poster': poster,
+        }
+        
         try:
+            # 0. 查询构建缓存（需要保留中间帧时不使用缓存）
+            cache_key = None
+            if self.cache is not None and not self.keep_frames and self.input_file.exists():
+                cache_key = self.cache.make_key(self.input_file, options)
+                cached = self.cache.get(cache_key, self.output_dir)
+                if cached is not None:
+                    cached['output_files'] = {
+                        format_name: str(self.output_dir / Path(file_path).name)
+                        for format_name, file_path in cached['output_files'].items()
+                    }
+                    cached['cache_hit'] = True
+                    print(f"⚡ 命中构建缓存，复用已有输出! 耗时: {time.time() - start_time:.2f} 秒")
+                    return cached
+            
             # 1. 分析文件
-            info = self.analyze_apng()
+            with self.stats.measure('analyze'):
+                info = self.analyze_apng()
             results['info'] = info
             print(f"📊 文件信息: {info['n_frames']} 帧, {info['file_size_mb']:.2f} MB")
             
-            # 2. 提取帧
-            self.extract_frames()
-            
-            # 3. 转换为 JPG
-            jpg_paths = self.convert_to_jpg(quality=jpg_quality, resize=resize)
-            results['jpg_frames'] = len(jpg_paths)
+            # 抽样保存源帧，编码完成后与输出比较
+            sampler = ReferenceSampler(info['n_frames'], metric_frames, matte)
+            # 顺带挑选封面帧，不需要再解码一遍
+            picker = PosterPicker(info['n_frames'], poster, matte) if poster else None
             
-            # 4. 创建不同格式的动图
-            output_files = {}
-            
-            # GIF
-            gif_path = self.output_dir / "compressed.gif"
-            output_files['gif'] = self.create_gif(str(gif_path), fps=gif_fps)
+            # 2-4. 流式处理：逐帧解码、转换并交给各编码器，不在内存中保留全部原始帧
+            with self.executor() as executor:
+                writers = {
+                    'gif': create_writer('gif', str(self.output_dir / "compressed.gif"), fps=gif_fps,
+                                         executor=executor,
+                                         delta=delta_frames, delta_threshold=delta_threshold,
+                                         palette=gif_palette, dither=gif_dither),
+                    'webp': create_writer('webp', str(self.output_dir / "compressed.webp"), fps=webp_fps,
+                                          delta=delta_frames, delta_threshold=delta_threshold),
+                }
+                video_suffix = VIDEO_CODECS[video_codec]['suffix']
+                writers[video_suffix] = create_video_writer(
+                    str(self.output_dir / f"compressed.{video_suffix}"), fps=mp4_fps,
+                    backend=video_backend, codec=video_codec, crf=crf, preset=video_preset,
+                    pix_fmt=pix_fmt, faststart=faststart, threads=video_threads
+                )
+                if alpha_outputs:
+                    writers['webp_alpha'] = create_writer('webp', str(self.output_dir / "compressed_alpha.webp"),
+                                                          fps=webp_fps, lossless=alpha_lossless,
+                                                          delta=delta_frames, delta_threshold=delta_threshold)
+                    writers['apng'] = create_writer('apng', str(self.output_dir / "compressed.png"),
+                                                    fps=webp_fps, colors=apng_colors)
+                
+                # 固定帧率输出按源时间轴重采样：低帧率输出丢弃（或混合）多余的帧
+                resampling = resample != 'none' and not variable_fps
+                if resampling:
+                    target_fps = {'gif': gif_fps, 'webp': webp_fps, video_suffix: mp4_fps,
+                                  'webp_alpha': webp_fps, 'apng': webp_fps}
+                    writers = {name: ResamplingWriter(writer, target_fps[name], resample, info.get('fps'))
+                               for name, writer in writers.items()}
+                
+                # 每个编码器在独立线程中并发运行，总耗时接近最慢的编码器
+                encoders = {name: EncoderThread(name, writer) for name, writer in writers.items()}
+                for encoder in encoders.values():
+                    encoder.start()
+                
+                output_count = 0
+                try:
+                    # 有透明输出或挑选封面帧时管线产出 RGBA 帧，再为其他编码器合成一份 RGB 帧；
+                    # 封面帧因此保留透明通道，与 create_poster（--poster-only）的结果一致
+                    keep_alpha = alpha_outputs or picker is not None
+                    frames = self.iter_prepared_frames(quality=jpg_quality, resize=resize,
+                                                       executor=executor, matte=matte,
+                                                       keep_alpha=keep_alpha)
+                    frames = sampler.wrap(progress(frames, total=info['n_frames'], desc="处理帧"))
+                    if picker is not None:
+                        frames = picker.wrap(frames)
+                    if variable_fps:
+                        # 帧时长在解码时写入 frame_durations，与产出的帧一一对应
+                        timed_frames = merge_similar_frames(
+                            ((frame, self.frame_durations[i]) for i, frame in enumerate(frames)),
+                            merge_threshold
+                        )
+                    elif resampling:
+                        timed_frames = ((frame, self.frame_durations[i]) for i, frame in enumerate(frames))
+                    else:
+                        timed_frames = ((frame, None) for frame in frames)
+                    
+                    for frame, duration in timed_frames:
+                        flat = frame
+                        if keep_alpha:
+                            with self.stats.measure('composite'):
+                                flat = composite_frame(frame, matte)
+                        for format_name, encoder in encoders.items():
+                            encoder.put(frame if format_name in ALPHA_FORMATS else flat, duration)
+                        output_count += 1
+                except BaseException:
+                    cancel_encoders(encoders)
+                    raise
+                
+                output_files = finish_encoders(encoders)
+                frame_count = len(self.frame_durations)
+                results['frame_count'] = frame_count
+                results['output_frames'] = output_count
+                if self.keep_frames:
+                    results['jpg_frames'] = frame_count
+                if output_count < frame_count:
+                    print(f"🔗 合并相似帧: {frame_count} → {output_count} 帧")
+                
+                # 各格式输出文件实际包含的帧数（重采样、合并未变化帧之后；
+                # GIF 编码器和 libwebp 还会合并连续的相同帧，因此从文件读取，视频按写入的帧数）
+                results['format_frames'] = {}
+                for name, writer in writers.items():
+                    count = count_frames(output_files[name])
+                    results['format_frames'][name] = len(writer.durations) if count is None else count
+                if resampling:
+                    counts = ", ".join(f"{name.upper()} {count}"
+                                       for name, count in results['format_frames'].items())
+                    print(f"⏱️ 按目标帧率重采样 ({resample}): {frame_count} 帧 → {counts}")
+                
+                results['timings'] = {}
+                for format_name, encoder in encoders.items():
+                    results['timings'][format_name] = encoder.elapsed
+                    self.stats.add(f"encode_{format_name}", encoder.elapsed,
+                                   results['format_frames'][format_name])
+                    self.stats.bytes_written += Path(output_files[format_name]).stat().st_size
+                    file_size = Path(output_files[format_name]).stat().st_size / (1024 * 1024)
+                    print(f"✅ {format_name.upper()} 创建完成: {output_files[format_name]} "
+                          f"({file_size:.2f} MB, 编码 {encoder.elapsed:.2f} 秒)")
             
-            # WebP
-            webp_path = self.output_dir / "compressed.webp"
-            output_files['webp'] = self.create_webp(str(webp_path), fps=webp_fps)
+            results['output_files'] = output_files
             
-            # MP4
-            mp4_path = self.output_dir / "compressed.mp4"
-            output_files['mp4'] = self.create_mp4(str(mp4_path), fps=mp4_fps)
+            # 封面帧、占位图和清单
+            poster_files = []
+            if picker is not None:
+                with self.stats.measure('poster'):
+                    results['poster'] = self._write_poster(picker, output_files, matte)
+                poster_files = [self.output_dir / name for name in ('poster.webp', 'poster.jpg', 'poster.json')]
+                for path in poster_files:
+                    self.stats.bytes_written += path.stat().st_size
             
-            results['output_files'] = output_files
+            # 5. 质量检查：抽样源帧与各输出中同一时刻的画面比较
+            if sampler.references:
+                metrics_start = time.time()
+                positions = sampler.positions(self.frame_durations
+                                              if variable_fps or resampling else None)
+                results['quality'] = {
+                    format_name: summarize(measure_output(file_path, positions,
+                                                          sum(writers[format_name].durations),
+                                                          sampler.size, matte))
+                    for format_name, file_path in output_files.items()
+                }
+                results['timings']['metrics'] = time.time() - metrics_start
+                self.stats.add('metrics', results['timings']['metrics'])
+                print(f"🔬 质量检查完成 ({len(positions)} 帧抽样, "
+                      f"{results['timings']['metrics']:.2f} 秒)")
             
-            # 5. 生成报告
-            self.generate_report(info, output_files)
+            # 6. 生成报告
+            with self.stats.measure('report'):
+                report_path = self.generate_report(info, output_files, results.get('quality'))
+            self.stats.bytes_written += report_path.stat().st_size
             
             elapsed_time = time.time() - start_time
+            results['elapsed_time'] = elapsed_time
+            results['cache_hit'] = False
+            results.update(self.stats.as_dict())
+            json_report_path = self.generate_json_report(results, options)
             print(f"✅ 处理完成! 耗时: {elapsed_time:.2f} 秒")
             
+            # 7. 写入构建缓存
+            if cache_key is not None:
+                self.cache.put(cache_key,
+                               list(output_files.values()) + poster_files + [report_path, json_report_path],
+                               results)
+            
             return results
             
         except Exception as e:
             print(f"❌ 处理失败: {e}")
             raise
     
-    def generate_report(self, info: dict, output_files: dict):
-        """生成处理报告"""
+    def _write_poster(self, picker: PosterPicker, output_files: Optional[dict] = None,
+                      matte: Tuple[int, int, int] = DEFAULT_MATTE) -> dict:
+        """写出选中的封面帧和 poster.json，返回清单内容"""
+        index, frame = picker.result()
+        manifest = write_poster(frame, self.output_dir, index, picker.strategy,
+                                durations=self.frame_durations, matte=matte,
+                                source=self.input_file.name,
+                                animations={name: Path(path).name
+                                            for name, path in (output_files or {}).items()})
+        webp_kb = manifest['poster']['webp']['bytes'] / 1024
+        jpg_kb = manifest['poster']['jpg']['bytes'] / 1024
+        print(f"🖼️  封面帧 ({picker.strategy}): 第 {index} 帧, WebP {webp_kb:.1f} KB, JPEG {jpg_kb:.1f} KB, "
+              f"占位图 {manifest['placeholder']['bytes']} 字节")
+        return manifest
+    
+    def create_poster(self, strategy: str = 'representative',
+                      resize: Optional[Tuple[int, int]] = None,
+                      matte: Tuple[int, int, int] = DEFAULT_MATTE) -> dict:
+        """只生成封面帧、占位图和 poster.json，不编码动图；first 策略只解码第一帧"""
+        print(f"🖼️  生成封面帧 ({strategy})...")
+        info = self.analyze_apng()
+        picker = PosterPicker(info['n_frames'], strategy, matte)
+        with self.executor() as executor:
+            frames = self.iter_prepared_frames(resize=resize, executor=executor, matte=matte,
+                                               keep_alpha=True)
+            for _ in picker.wrap(progress(frames, total=info['n_frames'], desc="选择封面帧")):
+                if picker.done:
+                    break
+        return self._write_poster(picker, matte=matte)
+    
+    def generate_report(self, info: dict, output_files: dict,
+                        quality: Optional[dict] = None) -> Path:
+        """生成处理报告；quality 为各格式的 SSIM/PSNR 统计"""
         report_path = self.output_dir / "compression_report.txt"
         
         with open(report_path, 'w', encoding='utf-8') as f:
@@ -343,9 +1737,165 @@ class APNGProcessor:
                     compression_ratio = (1 - size_mb / info['file_size_mb']) * 100
                     f.write(f"  {format_name.upper()}: {Path(file_path).name}\n")
                     f.write(f"    大小: {size_mb:.2f} MB\n")
-                    f.write(f"    压缩率: {compression_ratio:.1f}%\n\n")
+                    f.write(f"    压缩率: {compression_ratio:.1f}%\n")
+                    stats = (quality or {}).get(format_name, {})
+                    if 'ssim' in stats:
+                        f.write(f"    SSIM: 最低 {stats['ssim']['min']:.4f}, "
+                                f"平均 {stats['ssim']['mean']:.4f}, "
+                                f"P5 {stats['ssim']['p5']:.4f} ({stats['frames']} 帧抽样)\n")
+                        f.write(f"    PSNR: 最低 {stats['psnr']['min']:.2f} dB, "
+                                f"平均 {stats['psnr']['mean']:.2f} dB, "
+                                f"P5 {stats['psnr']['p5']:.2f} dB\n")
+                    f.write("\n")
         
         print(f"📋 报告已保存: {report_path}")
+        return report_path
+    
+    def generate_json_report(self, results: dict, options: dict) -> Path:
+        """生成机器可读的 JSON 报告：处理参数、各阶段耗时、峰值内存、读写字节数和输出信息"""
+        report_path = self.output_dir / "compression_report.json"
+        info = results['info']
+        
+        outputs = {}
+        for format_name, file_path in results['output_files'].items():
+            size_bytes = Path(file_path).stat().st_size
+            outputs[format_name] = {
+                'path': Path(file_path).name,
+                'size_bytes': size_bytes,
+                'compression_ratio': 1 - size_bytes / self.input_file.stat().st_size,
+                'encode_seconds': results['timings'].get(format_name),
+                'frames': results.get('format_frames', {}).get(format_name),
+                'quality': results.get('quality', {}).get(format_name),
+            }
+        
+        report = {
+            'input': {
+                'file': self.input_file.name,
+                'size_bytes': self.input_file.stat().st_size,
+                'format': info.get('format'),
+                'size': info.get('size'),
+                'n_frames': info.get('n_frames'),
+                'fps': info.get('fps'),
+            },
+            'options': options,
+            'workers': self.workers,
+            'frame_count': results.get('frame_count'),
+            'output_frames': results.get('output_frames'),
+            'elapsed_time': results['elapsed_time'],
+            'stages': results['stages'],
+            'peak_rss_mb': results['peak_rss_mb'],
+            'bytes_read': results['bytes_read'],
+            'bytes_written': results['bytes_written'],
+            'outputs': outputs,
+            'poster': results.get('poster'),
+        }
+        
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        
+        return report_path
+    
+    def process_renditions(self,
+                           heights: Iterable[int] = RENDITION_HEIGHTS,
+                           formats: Iterable[str] = ('webp',),
+                           webp_quality: int = 80,
+                           gif_fps: float = 10,
+                           webp_fps: float = 15,
+                           mp4_fps: float = 24,
+                           matte: Tuple[int, int, int] = DEFAULT_MATTE,
+                           resample: str = 'nearest') -> dict:
+        """多分辨率版本：只解码、合成一次，逐级缩小到每个目标尺寸并分别编码
+
+        每帧从最大的尺寸开始，每一级都由上一级缩小得到。
+        输出 compressed_{宽度}w.{格式} 和 renditions.json（宽度 → 文件、字节数，以及 srcset 字符串）。
+        resample 与 process_all 相同，按源时间轴重采样到各格式的帧率。
+        """
+        print("🚀 开始生成多分辨率版本...")
+        start_time = time.time()
+        
+        formats = list(formats)
+        for format_name in formats:
+            if format_name not in RENDITION_FORMATS:
+                raise ValueError(f"不支持的输出格式: {format_name}")
+        
+        with self.stats.measure('analyze'):
+            info = self.analyze_apng()
+        sizes = rendition_sizes(info['size'], heights)
+        print(f"📐 目标尺寸: {', '.join(f'{w}x{h}' for w, h in sizes)}")
+        
+        with self.executor() as executor:
+            writers = {}
+            for width, height in sizes:
+                for format_name in formats:
+                    path = str(self.output_dir / f"compressed_{width}w.{format_name}")
+                    if format_name == 'gif':
+                        writer = create_writer('gif', path, fps=gif_fps, executor=executor)
+                    elif format_name == 'webp':
+                        writer = create_writer('webp', path, quality=webp_quality, fps=webp_fps)
+                    else:
+                        writer = create_video_writer(path, fps=mp4_fps)
+                    if resample != 'none':
+                        fps = {'gif': gif_fps, 'webp': webp_fps, 'mp4': mp4_fps}[format_name]
+                        writer = ResamplingWriter(writer, fps, resample, info.get('fps'))
+                    writers[(width, height), format_name] = writer
+            
+            encoders = {key: EncoderThread(f"{key[1]}-{key[0][0]}w", writer)
+                        for key, writer in writers.items()}
+            for encoder in encoders.values():
+                encoder.start()
+            
+            try:
+                frames = self.iter_prepared_frames(executor=executor, matte=matte)
+                for i, frame in enumerate(progress(frames, total=info['n_frames'], desc="处理帧")):
+                    duration = self.frame_durations[i] if resample != 'none' else None
+                    current = frame
+                    for size in sizes:
+                        if current.size != size:
+                            with self.stats.measure('resize'):
+                                current = resize_frame(current, size, self.resize_engine)
+                        for format_name in formats:
+                            encoders[size, format_name].put(current, duration)
+            except BaseException:
+                cancel_encoders(encoders)
+                raise
+            
+            output_files = finish_encoders(encoders)
+        
+        renditions = []
+        for width, height in reversed(sizes):
+            files = {}
+            for format_name in formats:
+                path = Path(output_files[(width, height), format_name])
+                files[format_name] = {'path': path.name, 'bytes': path.stat().st_size}
+                self.stats.bytes_written += files[format_name]['bytes']
+            renditions.append({'width': width, 'height': height, 'files': files})
+        
+        manifest = {
+            'source': self.input_file.name,
+            'source_size': list(info['size']),
+            'renditions': renditions,
+            # 可直接用于 <img srcset> / <source srcset>
+            'srcset': {
+                format_name: ", ".join(
+                    f"{item['files'][format_name]['path']} {item['width']}w" for item in renditions
+                )
+                for format_name in formats
+            },
+        }
+        manifest_path = self.output_dir / "renditions.json"
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        
+        for item in renditions:
+            sizes_text = ", ".join(f"{fmt.upper()} {file['bytes'] / (1024 * 1024):.2f} MB"
+                                   for fmt, file in item['files'].items())
+            print(f"✅ {item['width']}x{item['height']}: {sizes_text}")
+        print(f"📋 清单已保存: {manifest_path}")
+        print(f"✅ 处理完成! 耗时: {time.time() - start_time:.2f} 秒")
+        
+        manifest['manifest_path'] = str(manifest_path)
+        manifest['elapsed_time'] = time.time() - start_time
+        return manifest
 
 
 def main():
@@ -357,9 +1907,58 @@ def main():
     parser.add_argument("--gif-fps", type=float, default=10, help="GIF 帧率")
     parser.add_argument("--webp-fps", type=float, default=15, help="WebP 帧率")
     parser.add_argument("--mp4-fps", type=float, default=24, help="MP4 帧率")
+    parser.add_argument("--resize-engine", choices=RESIZE_ENGINES, default='pil',
+                        help="缩放引擎: pil (reduce + LANCZOS), cv2 (INTER_AREA), numpy (块平均 + LANCZOS)；"
+                             "auto 有 OpenCV 时使用 cv2")
+    parser.add_argument("--keep-frames", action="store_true", help="保留中间帧文件 (frames/ 和 jpg_frames/)")
+    parser.add_argument("--vfr", action="store_true", help="可变帧率：保留源文件逐帧时长并合并相似帧")
+    parser.add_argument("--merge-threshold", type=int, default=0,
+                        help="可变帧率模式下合并相似帧的最大像素差 (0-255, 0 表示只合并完全相同的帧)")
+    parser.add_argument("--resample", choices=RESAMPLE_MODES, default='nearest',
+                        help="目标帧率低于源帧率时的重采样方式：nearest 丢帧，blend 按时长混合，none 不重采样")
+    parser.add_argument("--delta", action="store_true", help="GIF/WebP 只编码相对上一帧变化的区域")
+    parser.add_argument("--delta-threshold", type=int, default=0,
+                        help="增量编码时视为未变化的最大像素差 (0-255)")
+    parser.add_argument("--gif-palette", choices=GIF_PALETTE_MODES, default='frame',
+                        help="GIF 调色板: frame 每帧独立量化, global 所有帧共享一个调色板")
+    parser.add_argument("--gif-dither", choices=GIF_DITHER_MODES, default='none',
+                        help="共享调色板时的抖动方式")
+    parser.add_argument("--matte", type=parse_color, default=DEFAULT_MATTE,
+                        help="合成透明区域的背景色 (如 #ffffff 或 255,255,255，默认白色)")
+    parser.add_argument("--alpha", action="store_true",
+                        help="额外输出保留透明通道的 WebP (compressed_alpha.webp) 和 APNG (compressed.png)")
+    parser.add_argument("--alpha-lossless", action="store_true", help="透明 WebP 使用无损编码")
+    parser.add_argument("--apng-colors", type=int, default=None,
+                        help="APNG 量化到共享调色板的颜色数 (2-256，默认不量化)")
+    parser.add_argument("--video-backend", choices=VIDEO_BACKENDS, default='auto',
+                        help="视频编码后端: auto 有 ffmpeg 时使用 ffmpeg，否则使用 OpenCV")
+    parser.add_argument("--video-codec", choices=list(VIDEO_CODECS), default='h264',
+                        help="视频编码: h264 输出 MP4, vp9 输出 WebM (需要 ffmpeg)")
+    parser.add_argument("--crf", type=int, default=23, help="视频 CRF (越小质量越高)")
+    parser.add_argument("--preset", choices=VIDEO_PRESETS, default='medium', help="视频编码速度预设")
+    parser.add_argument("--pix-fmt", default='yuv420p', help="视频像素格式 (默认 yuv420p，兼容性最好)")
+    parser.add_argument("--no-faststart", action="store_true", help="MP4 不把 moov 移到文件开头")
+    parser.add_argument("--video-threads", type=int, default=0, help="视频编码线程数 (0 为自动)")
+    parser.add_argument("--poster", nargs='?', const='representative', choices=POSTER_STRATEGIES, default=None,
+                        help="输出封面帧、内联占位图和 poster.json (不带值时为 representative)")
+    parser.add_argument("--poster-only", action="store_true", help="只生成封面帧和 poster.json，不编码动图")
+    parser.add_argument("--metric-frames", type=int, default=REPORT_SAMPLE_FRAMES,
+                        help="质量检查 (SSIM/PSNR) 抽样的帧数，0 表示不检查")
+    parser.add_argument("--workers", type=int, default=None, help="逐帧处理的并行进程数 (默认: CPU 核心数)")
+    parser.add_argument("--decoder", choices=DECODERS, default='auto',
+                        help="帧解码器: native 为原生 APNG 解码器 (多线程解压)，auto 在多核机器上使用 native")
+    parser.add_argument("--no-cache", action="store_true", help="不使用构建缓存，强制重新编码")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR), help="构建缓存目录")
+    parser.add_argument("--cache-max-mb", type=float, default=1024, help="构建缓存容量上限 (MB)")
     
     args = parser.parse_args()
     
+    try:
+        check_apng_colors(args.apng_colors)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    
     # 解析调整大小参数
     resize = None
     if args.resize:
@@ -371,16 +1970,48 @@ def main():
             return
     
     # 创建处理器
-    processor = APNGProcessor(args.input, args.output)
+    cache = None if args.no_cache else BuildCache(args.cache_dir, args.cache_max_mb)
+    try:
+        processor = APNGProcessor(args.input, args.output, keep_frames=args.keep_frames,
+                                  workers=args.workers, cache=cache, decoder=args.decoder,
+                                  resize_engine=args.resize_engine)
+    except ImportError as e:
+        print(f"❌ {e}")
+        return 1
     
     try:
+        if args.poster_only:
+            processor.create_poster(args.poster or 'representative', resize=resize, matte=args.matte)
+            print(f"\n🎉 封面帧已生成: {args.output}/poster.json")
+            return 0
+        
         # 执行处理
         results = processor.process_all(
             jpg_quality=args.quality,
             resize=resize,
             gif_fps=args.gif_fps,
             webp_fps=args.webp_fps,
-            mp4_fps=args.mp4_fps
+            mp4_fps=args.mp4_fps,
+            variable_fps=args.vfr,
+            resample=args.resample,
+            merge_threshold=args.merge_threshold,
+            delta_frames=args.delta,
+            delta_threshold=args.delta_threshold,
+            gif_palette=args.gif_palette,
+            gif_dither=args.gif_dither,
+            metric_frames=args.metric_frames,
+            matte=args.matte,
+            alpha_outputs=args.alpha,
+            alpha_lossless=args.alpha_lossless,
+            apng_colors=args.apng_colors,
+            video_backend=args.video_backend,
+            video_codec=args.video_codec,
+            crf=args.crf,
+            video_preset=args.preset,
+            pix_fmt=args.pix_fmt,
+            faststart=not args.no_faststart,
+            video_threads=args.video_threads,
+            poster=args.poster
         )
         
         print("\n🎉 处理完成!")
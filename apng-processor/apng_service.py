@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+APNG 处理服务
+常驻进程，通过本地 HTTP 接口接收压缩任务，在预热的进程池中执行。
+工作进程启动时导入 PIL / numpy / cv2 等依赖，之后的任务不再重复启动解释器和导入模块。
+排队和执行中的任务总数有上限，超出时返回 429，由客户端稍后重试（背压）。
+
+接口：
+  POST   /jobs              提交任务 {"input": ..., "output_dir": ..., "options": {...}}
+  GET    /jobs              列出任务
+  GET    /jobs/<id>?wait=N  查询任务状态和结果，wait 为最长等待完成的秒数
+  DELETE /jobs/<id>         取消尚未开始的任务
+  GET    /health            服务状态
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import argparse
+import importlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apng_processor import APNG_COLOR_RANGE
+from batch_process import process_one
+from build_cache import DEFAULT_CACHE_DIR
+from lazy_imports import has_module
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# 任务选项默认值，与 batch_process.py 的命令行默认值一致
+DEFAULT_JOB_OPTIONS = {
+    'quality': 80,
+    'height': 720,
+    'gif_fps': 12,
+    'webp_fps': 15,
+    'mp4_fps': 24,
+    'keep_frames': False,
+    'frame_workers': 1,
+    'cache_dir': str(DEFAULT_CACHE_DIR),
+    'cache_max_mb': 1024,
+    'alpha': False,
+    'apng_colors': None,
+}
+
+# 任务选项的类型和取值范围：(类型, 最小值, 最大值)，范围为 None 表示不限
+# 帧率和缓存容量可以是整数或小数；cache_dir 为 null 或空字符串时不使用缓存；
+# apng_colors 为 null 时 APNG 不量化，范围与命令行的 --apng-colors 相同
+JOB_OPTION_TYPES = {
+    'quality': (int, 1, 100),
+    'height': (int, 0, 16384),
+    'gif_fps': (float, 0.1, 120),
+    'webp_fps': (float, 0.1, 120),
+    'mp4_fps': (float, 0.1, 120),
+    'keep_frames': (bool, None, None),
+    'frame_workers': (int, 1, 256),
+    'cache_dir': (str, None, None),
+    'cache_max_mb': (float, 1, None),
+    'alpha': (bool, None, None),
+    'apng_colors': (int,) + APNG_COLOR_RANGE,
+}
+
+# 可以为 null 的选项
+NULLABLE_OPTIONS = ('cache_dir', 'apng_colors')
+
+# 保留的已结束任务数，超出后丢弃最早结束的任务
+DEFAULT_HISTORY = 1000
+
+# 请求体大小上限（字节）
+MAX_BODY_BYTES = 1024 * 1024
+
+# 长轮询的最长等待时间（秒）
+MAX_WAIT_SECONDS = 300
+
+
+def warm_worker():
+    """工作进程初始化：提前导入编码依赖，第一个任务不再付出导入开销
+
+    apng_processor 按需导入 NumPy / OpenCV，常驻进程在这里一次性导入。
+    """
+    import apng_processor  # noqa: F401
+    for name in ('numpy', 'cv2'):
+        if has_module(name):
+            importlib.import_module(name)
+
+
+def validate_options(options) -> dict:
+    """检查任务选项的名称、类型和取值范围，返回补全默认值后的选项；无效时抛出 ValueError"""
+    if options is None:
+        options = {}
+    if not isinstance(options, dict):
+        raise ValueError("options 必须是对象")
+    unknown = set(options) - set(DEFAULT_JOB_OPTIONS)
+    if unknown:
+        raise ValueError(f"未知选项: {', '.join(sorted(unknown))}")
+
+    for name, value in options.items():
+        kind, low, high = JOB_OPTION_TYPES[name]
+        if value is None and name in NULLABLE_OPTIONS:
+            continue
+        if kind is str:
+            if not isinstance(value, str):
+                raise ValueError(f"{name} 必须是字符串或 null")
+            continue
+        # JSON 的 true/false 在 Python 中也是 int，数值选项不接受布尔值
+        if kind is bool:
+            valid = isinstance(value, bool)
+        elif kind is int:
+            valid = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+        if not valid:
+            type_name = {bool: '布尔值', int: '整数', float: '数字'}[kind]
+            raise ValueError(f"{name} 必须是{type_name}: {value!r}")
+        if (low is not None and value < low) or (high is not None and value > high):
+            bound = f"{low}-{high}" if high is not None else f">= {low}"
+            raise ValueError(f"{name} 超出范围 ({bound}): {value!r}")
+
+    return {**DEFAULT_JOB_OPTIONS, **options}
+
+
+class Job:
+    """单个任务的状态：queued → running → done / error，排队中的任务可以 cancelled"""
+
+    def __init__(self, input_file: str, output_dir: str, options: dict):
+        self.id = uuid.uuid4().hex[:12]
+        self.input = input_file
+        self.output_dir = output_dir
+        self.options = options
+        self.status = 'queued'
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def as_dict(self, include_result: bool = True) -> dict:
+        job = {
+            'id': self.id,
+            'status': self.status,
+            'input': self.input,
+            'output_dir': self.output_dir,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+        if include_result:
+            job['options'] = self.options
+            job['result'] = self.result
+            job['error'] = self.error
+        return job
+
+
+class JobQueueFull(Exception):
+    """排队任务已达上限"""
+
+
+class JobQueue:
+    """在常驻进程池中执行任务，限制排队和执行中的任务总数
+
+    进程池中同时只提交 jobs 个任务，其余在本地队列中等待，
+    因此任务状态准确，排队中的任务随时可以取消。
+    工作进程异常退出（被杀死、内存不足等）时进程池损坏，其中执行的任务记为出错，
+    并创建新的进程池继续处理排队的任务。
+    """
+
+    def __init__(self, jobs: int = os.cpu_count() or 1, max_pending: Optional[int] = None,
+                 output_root: str = "service_output", history: int = DEFAULT_HISTORY):
+        self.jobs = jobs
+        # 默认允许每个工作进程排 4 个任务
+        self.max_pending = max_pending or jobs * 4
+        self.output_root = Path(output_root)
+        self.history = history
+        self.executor = self._create_executor()
+        self.records = OrderedDict()
+        self.waiting = deque()
+        self.running = 0
+        self.completed = 0
+        self.restarts = 0
+        # 可重入：已结束的 future 在 add_done_callback 中会立即回调 _finish
+        self.lock = threading.RLock()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.jobs, initializer=warm_worker)
+
+    def _restart_executor(self, broken: ProcessPoolExecutor):
+        """替换已损坏的进程池（调用方持有锁）；同一个进程池只替换一次"""
+        if self.executor is not broken:
+            return
+        print("⚠️  工作进程异常退出，重新创建进程池")
+        self.executor = self._create_executor()
+        self.restarts += 1
+        broken.shutdown(wait=False)
+
+    @property
+    def pending(self) -> int:
+        return len(self.waiting) + self.running
+
+    def submit(self, input_file: str, output_dir: Optional[str] = None,
+               options: Optional[dict] = None) -> Job:
+        """提交任务；队列已满时抛出 JobQueueFull，参数无效时抛出 ValueError
+
+        先检查容量，任务被接受后才创建输出目录，被拒绝的任务不会在磁盘上留下任何东西。
+        """
+        if not isinstance(input_file, str) or (output_dir is not None and not isinstance(output_dir, str)):
+            raise ValueError("input 和 output_dir 必须是字符串")
+        options = validate_options(options)
+        if not Path(input_file).is_file():
+            raise ValueError(f"文件不存在: {input_file}")
+
+        job = Job(input_file, output_dir, options)
+        if not output_dir:
+            # 保留扩展名并加上任务 ID：u1.png 和 u1.gif、同一文件的多个任务不会写入同一个目录
+            job.output_dir = output_dir = str(self.output_root / f"{Path(input_file).name}-{job.id}")
+
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise JobQueueFull(f"排队任务已达上限 ({self.max_pending})")
+            try:
+                Path(output_dir).mkdir(parents=True, exist_ok=True)
+            except OSError as e:
+                raise ValueError(f"无法创建输出目录: {e}")
+            self.records[job.id] = job
+            self.waiting.append(job)
+            self._dispatch()
+        return job
+
+    def _dispatch(self):
+        """有空闲工作进程时把排队的任务交给进程池（调用方持有锁）"""
+        while self.waiting and self.running < self.jobs:
+            job = self.waiting.popleft()
+            job.status = 'running'
+            job.started = time.time()
+            self.running += 1
+            executor = self.executor
+            try:
+                try:
+                    future = executor.submit(process_one, job.input, job.output_dir, job.options)
+                except BrokenProcessPool:
+                    # 进程池已损坏但回调尚未处理，换新的进程池后重新提交
+                    self._restart_executor(executor)
+                    executor = self.executor
+                    future = executor.submit(process_one, job.input, job.output_dir, job.options)
+            except Exception as e:
+                # 新进程池也无法接受任务（再次损坏或服务正在关闭）：任务记为出错，释放占用的名额
+                job.status = 'error'
+                job.error = f"无法提交任务: {e}"
+                job.finished = time.time()
+                self.running -= 1
+                self.completed += 1
+                job.done.set()
+                continue
+            future.add_done_callback(
+                lambda future, job=job, executor=executor: self._finish(job, future, executor))
+
+    def _finish(self, job: Job, future, executor: ProcessPoolExecutor):
+        broken = False
+        try:
+            job.result = future.result()
+            job.status = 'done' if job.result.get('status') == 'ok' else 'error'
+            job.error = job.result.get('error')
+        except BrokenProcessPool as e:
+            # 工作进程异常退出：该进程池中执行的任务都无法完成
+            job.status = 'error'
+            job.error = f"工作进程异常退出: {e}"
+            broken = True
+        except Exception as e:
+            # process_one 自身的错误已写入 result，这里只有无法序列化结果等情况
+            job.status = 'error'
+            job.error = str(e)
+        job.finished = time.time()
+
+        with self.lock:
+            if broken:
+                self._restart_executor(executor)
+            self.running -= 1
+            self.completed += 1
+            self._evict()
+            self._dispatch()
+        job.done.set()
+
+    def _evict(self):
+        """只保留最近 history 个已结束的任务（调用方持有锁）"""
+        finished = [job_id for job_id, job in self.records.items() if job.finished is not None]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.records[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.records.get(job_id)
+
+    def list(self) -> list:
+        with self.lock:
+            return list(self.records.values())
+
+    def wait(self, job: Job, timeout: float) -> bool:
+        """等待任务结束，超时返回 False"""
+        return job.done.wait(timeout)
+
+    def cancel(self, job: Job) -> bool:
+        """取消排队中的任务；已开始或已结束的任务返回 False"""
+        with self.lock:
+            if job.status != 'queued':
+                return False
+            self.waiting.remove(job)
+            job.status = 'cancelled'
+            job.finished = time.time()
+            self._evict()
+        job.done.set()
+        return True
+
+    def health(self) -> dict:
+        with self.lock:
+            return {
+                'status': 'ok',
+                'workers': self.jobs,
+                'running': self.running,
+                'queued': len(self.waiting),
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'pool_restarts': self.restarts,
+            }
+
+    def shutdown(self):
+        """取消排队中的任务，等待执行中的任务结束"""
+        with self.lock:
+            waiting = list(self.waiting)
+        for job in waiting:
+            self.cancel(job)
+        self.executor.shutdown(wait=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """HTTP 接口，所有请求和响应均为 JSON"""
+
+    server_version = "APNGService/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status: HTTPStatus, payload, headers: Optional[dict] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: HTTPStatus, message: str, headers: Optional[dict] = None):
+        self.send_json(status, {'error': message}, headers)
+
+    def route(self):
+        """解析路径，返回 (资源, 任务 ID, 查询参数)"""
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if len(parts) > 2:
+            return None, None, {}
+        resource = parts[0] if parts else ''
+        job_id = parts[1] if len(parts) > 1 else None
+        return resource, job_id, parse_qs(url.query)
+
+    def find_job(self, job_id: Optional[str]) -> Optional[Job]:
+        job = self.server.queue.get(job_id) if job_id else None
+        if job is None:
+            self.send_error_json(HTTPStatus.NOT_FOUND, f"任务不存在: {job_id}")
+        return job
+
+    def do_GET(self):
+        resource, job_id, query = self.route()
+        if resource == 'health':
+            self.send_json(HTTPStatus.OK, self.server.queue.health())
+        elif resource == 'jobs' and job_id is None:
+            jobs = [job.as_dict(include_result=False) for job in self.server.queue.list()]
+            self.send_json(HTTPStatus.OK, {'jobs': jobs})
+        elif resource == 'jobs':
+            job = self.find_job(job_id)
+            if job is None:
+                return
+            try:
+                timeout = min(float(query.get('wait', ['0'])[0]), MAX_WAIT_SECONDS)
+            except ValueError:
+                self.send_error_json(HTTPStatus.BAD_REQUEST, "wait 必须是秒数")
+                return
+            if timeout > 0:
+                self.server.queue.wait(job, timeout)
+            self.send_json(HTTPStatus.OK, job.as_dict())
+        else:
+            self.send_error_json(HTTPStatus.NOT_FOUND, f"未知路径: {self.path}")
+
+    def do_POST(self):
+        resource, job_id, _ = self.route()
+        if resource != 'jobs' or job_id is not None:
+            self.send_error_json(HTTPStatus.NOT_FOUND, f"未知路径: {self.path}")
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, "无效的 Content-Length")
+            return
+        if length > MAX_BODY_BYTES:
+            self.send_error_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"请求体过大 (上限 {MAX_BODY_BYTES} 字节)")
+            return
+        try:
+            try:
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except json.JSONDecodeError as e:
+                raise ValueError(f"无效的 JSON: {e}")
+            if not isinstance(payload, dict) or 'input' not in payload:
+                raise ValueError("缺少 input 字段")
+            job = self.server.queue.submit(payload['input'], payload.get('output_dir'),
+                                           payload.get('options'))
+        except JobQueueFull as e:
+            self.send_error_json(HTTPStatus.TOO_MANY_REQUESTS, str(e), {'Retry-After': '1'})
+            return
+        except (ValueError, TypeError) as e:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        self.send_json(HTTPStatus.ACCEPTED, job.as_dict(include_result=False),
+                       {'Location': f"/jobs/{job.id}"})
+
+    def do_DELETE(self):
+        resource, job_id, _ = self.route()
+        if resource != 'jobs':
+            self.send_error_json(HTTPStatus.NOT_FOUND, f"未知路径: {self.path}")
+            return
+        job = self.find_job(job_id)
+        if job is None:
+            return
+        if not self.server.queue.cancel(job):
+            self.send_error_json(HTTPStatus.CONFLICT, f"任务已开始或已结束: {job.status}")
+            return
+        self.send_json(HTTPStatus.OK, job.as_dict(include_result=False))
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, queue: JobQueue, verbose: bool = False):
+        super().__init__(address, ServiceHandler)
+        self.queue = queue
+        self.verbose = verbose
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APNG 处理服务（本地 HTTP 任务队列）")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"监听地址 (默认: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"监听端口 (默认: {DEFAULT_PORT})")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="同时处理的任务数 (默认: CPU 核心数)")
+    parser.add_argument("--max-pending", type=int,
+                        help="排队和执行中的任务总数上限，超出时返回 429 (默认: jobs x 4)")
+    parser.add_argument("-o", "--output", default="service_output",
+                        help="任务未指定 output_dir 时的输出根目录")
+    parser.add_argument("--history", type=int, default=DEFAULT_HISTORY, help="保留的已结束任务数")
+    parser.add_argument("-v", "--verbose", action="store_true", help="打印每个请求")
+
+    args = parser.parse_args()
+
+    queue = JobQueue(jobs=args.jobs, max_pending=args.max_pending,
+                     output_root=args.output, history=args.history)
+    # 提前启动全部工作进程，第一个任务不等待进程创建和模块导入
+    wait_futures([queue.executor.submit(warm_worker) for _ in range(args.jobs)])
+
+    server = ServiceServer((args.host, args.port), queue, verbose=args.verbose)
+    print("🎬 APNG 处理服务")
+    print("=" * 30)
+    print(f"🌐 监听: http://{args.host}:{server.server_port}")
+    print(f"⚙️  工作进程: {queue.jobs}, 排队上限: {queue.max_pending}")
+
+    # SIGTERM 与 Ctrl+C 一样停止服务；shutdown 需要在 serve_forever 之外的线程调用
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("\n🛑 正在停止服务，等待执行中的任务结束...")
+        server.server_close()
+        queue.shutdown()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+批量 APNG 处理器
+遍历整个目录，找出所有动图（APNG/GIF/WebP），使用共享进程池批量压缩，
+输出镜像目录结构，并生成一份 JSON 汇总报告
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from PIL import Image
+
+from apng_parser import is_png, parse_apng
+from apng_processor import APNGProcessor, check_apng_colors
+from build_cache import BuildCache, DEFAULT_CACHE_DIR
+
+# 默认跳过的目录
+DEFAULT_EXCLUDES = ['node_modules', '.git', '.next', '.idea', '__pycache__']
+
+# 网站中有扩展名为 .png 的动画 WebP，按文件内容而不是扩展名判断格式
+ANIMATED_SUFFIXES = ('.png', '.apng', '.gif', '.webp')
+ANIMATED_FORMATS = ('GIF', 'WEBP')
+
+
+def is_animated_image(path: Path) -> bool:
+    """判断文件是否为动图（只读取文件头，不解码帧）"""
+    try:
+        if is_png(path):
+            return parse_apng(path)['is_animated']
+        with Image.open(path) as img:
+            return img.format in ANIMATED_FORMATS and getattr(img, 'is_animated', False)
+    except Exception:
+        return False
+
+
+def find_animated_images(root: Path, excludes: List[str], skip_dirs: List[Path] = ()) -> List[Path]:
+    """递归查找目录下所有动图，跳过 excludes 中的目录名和 skip_dirs 中的目录"""
+    skip_dirs = {Path(d).resolve() for d in skip_dirs}
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        current = Path(dirpath)
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if d not in excludes and (current / d).resolve() not in skip_dirs
+        )
+        for filename in sorted(filenames):
+            path = current / filename
+            if path.suffix.lower() in ANIMATED_SUFFIXES and is_animated_image(path):
+                found.append(path)
+    return found
+
+
+def fit_height(size, target_height: Optional[int]):
+    """按目标高度计算保持宽高比的尺寸（宽度取偶数，不放大）"""
+    width, height = size
+    if not target_height or target_height >= height:
+        return None
+    target_width = int(target_height * width / height)
+    # 确保宽度是偶数（视频编码要求）
+    if target_width % 2 != 0:
+        target_width += 1
+    return target_width, target_height
+
+
+def process_one(input_file: str, output_dir: str, options: dict) -> dict:
+    """在子进程中处理单个文件，返回可序列化的结果"""
+    start_time = time.time()
+    summary = {'input': input_file, 'output_dir': output_dir}
+
+    try:
+        with Image.open(input_file) as img:
+            resize = fit_height(img.size, options['height'])
+
+        cache = None
+        if options['cache_dir']:
+            cache = BuildCache(options['cache_dir'], options['cache_max_mb'])
+
+        processor = APNGProcessor(input_file, output_dir,
+                                  keep_frames=options['keep_frames'],
+                                  workers=options['frame_workers'],
+                                  cache=cache)
+        results = processor.process_all(
+            jpg_quality=options['quality'],
+            resize=resize,
+            gif_fps=options['gif_fps'],
+            webp_fps=options['webp_fps'],
+            mp4_fps=options['mp4_fps'],
+            alpha_outputs=options['alpha'],
+            apng_colors=options['apng_colors']
+        )
+
+        summary['status'] = 'ok'
+        summary['resize'] = resize
+        summary['info'] = results['info']
+        summary['timings'] = results.get('timings', {})
+        summary['stages'] = results.get('stages', {})
+        summary['peak_rss_mb'] = results.get('peak_rss_mb')
+        summary['cache_hit'] = results.get('cache_hit', False)
+        summary['outputs'] = {
+            format_name: {
+                'path': file_path,
+                'size_bytes': Path(file_path).stat().st_size,
+            }
+            for format_name, file_path in results['output_files'].items()
+        }
+    except Exception as e:
+        summary['status'] = 'error'
+        summary['error'] = str(e)
+
+    summary['elapsed_time'] = time.time() - start_time
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量 APNG 处理器")
+    parser.add_argument("input_dir", help="要扫描的目录（如 ../public 或 ../index/images）")
+    parser.add_argument("-o", "--output", default="batch_output", help="输出目录（镜像输入目录结构）")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="同时处理的文件数 (默认: CPU 核心数)")
+    parser.add_argument("--frame-workers", type=int, default=1,
+                        help="每个文件内部逐帧处理的进程数 (默认: 1)")
+    parser.add_argument("-q", "--quality", type=int, default=80, help="JPG 质量 (1-100)")
+    parser.add_argument("--height", type=int, default=720, help="目标高度，保持宽高比 (0 表示不缩放)")
+    parser.add_argument("--gif-fps", type=float, default=12, help="GIF 帧率")
+    parser.add_argument("--webp-fps", type=float, default=15, help="WebP 帧率")
+    parser.add_argument("--mp4-fps", type=float, default=24, help="MP4 帧率")
+    parser.add_argument("--keep-frames", action="store_true", help="保留中间帧文件")
+    parser.add_argument("--alpha", action="store_true",
+                        help="额外输出保留透明通道的 WebP 和 APNG")
+    parser.add_argument("--apng-colors", type=int, default=None,
+                        help="APNG 量化到共享调色板的颜色数 (2-256，默认不量化)")
+    parser.add_argument("--exclude", action="append", default=[], help="跳过的目录名，可多次指定")
+    parser.add_argument("--no-cache", action="store_true", help="不使用构建缓存，强制重新编码")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR), help="构建缓存目录")
+    parser.add_argument("--cache-max-mb", type=float, default=1024, help="构建缓存容量上限 (MB)")
+
+    args = parser.parse_args()
+
+    try:
+        check_apng_colors(args.apng_colors)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    input_root = Path(args.input_dir)
+    output_root = Path(args.output)
+    if not input_root.is_dir():
+        print(f"❌ 目录不存在: {input_root}")
+        return 1
+
+    print("🎬 批量 APNG 处理器")
+    print("=" * 30)
+
+    print(f"🔍 扫描目录: {input_root}")
+    # 跳过输出目录，避免重复处理已生成的动图
+    files = find_animated_images(input_root, DEFAULT_EXCLUDES + args.exclude, [output_root])
+    print(f"📊 找到 {len(files)} 个动图")
+
+    if not files:
+        return 0
+
+    output_root.mkdir(parents=True, exist_ok=True)
+
+    options = {
+        'quality': args.quality,
+        'height': args.height,
+        'gif_fps': args.gif_fps,
+        'webp_fps': args.webp_fps,
+        'mp4_fps': args.mp4_fps,
+        'keep_frames': args.keep_frames,
+        'frame_workers': args.frame_workers,
+        'cache_dir': None if args.no_cache else args.cache_dir,
+        'cache_max_mb': args.cache_max_mb,
+        'alpha': args.alpha,
+        'apng_colors': args.apng_colors,
+    }
+
+    start_time = time.time()
+    summaries = []
+
+    # 共享进程池，jobs 限制同时处理的文件数
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {}
+        for path in files:
+            # 镜像目录结构: a/b/u1.png -> output/a/b/u1.png/
+            # 保留扩展名，同名不同格式的文件（u1.png 和 u1.gif）不会写入同一个目录
+            relative = path.relative_to(input_root)
+            output_dir = output_root / relative
+            output_dir.mkdir(parents=True, exist_ok=True)
+            futures[executor.submit(process_one, str(path), str(output_dir), options)] = path
+
+        for i, future in enumerate(as_completed(futures), 1):
+            summary = future.result()
+            summaries.append(summary)
+            status = "✅" if summary['status'] == 'ok' else "❌"
+            cached = " ⚡缓存" if summary.get('cache_hit') else ""
+            print(f"{status} [{i}/{len(files)}] {futures[future]} ({summary['elapsed_time']:.2f} 秒){cached}")
+
+    summaries.sort(key=lambda item: item['input'])
+    failed = [item for item in summaries if item['status'] != 'ok']
+
+    report = {
+        'input_dir': str(input_root),
+        'cache_hits': sum(1 for item in summaries if item.get('cache_hit')),
+        'output_dir': str(output_root),
+        'options': options,
+        'jobs': args.jobs,
+        'total_files': len(summaries),
+        'failed_files': len(failed),
+        'elapsed_time': time.time() - start_time,
+        'files': summaries,
+    }
+
+    summary_path = output_root / "batch_summary.json"
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\n🎉 批量处理完成! 成功 {len(summaries) - len(failed)}/{len(summaries)}, "
+          f"耗时: {report['elapsed_time']:.2f} 秒")
+    print(f"📋 汇总报告: {summary_path}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
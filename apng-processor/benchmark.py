@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+APNG 处理管线基准测试
+在本地生成不同尺寸、帧数、透明度和运动类型的合成 APNG，
+分别测量解码、帧准备、各缩放引擎、各编码器和完整流程的吞吐量（帧/秒、MB/秒）、
+峰值内存和各格式输出大小。支持保存基线并与之后的运行结果比较。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import numpy as np
+from PIL import Image
+
+from apng_processor import APNGProcessor, GIFWriter, WebPWriter, MP4Writer
+from pipeline_stats import peak_rss_mb
+from resizing import RESIZE_ENGINES, even_size, resize_frame
+
+# 合成素材：名称 → (宽, 高, 帧数, 是否透明, 运动类型)
+DEFAULT_CASES = {
+    'small-static': (320, 240, 60, False, 'static'),
+    'small-alpha-pan': (320, 240, 60, True, 'pan'),
+    'sd-long-static': (640, 360, 240, False, 'static'),
+    'hd-pan': (1280, 720, 30, False, 'pan'),
+    'hd-alpha-noise': (1280, 720, 30, True, 'noise'),
+    'fhd-pan': (1920, 1080, 30, False, 'pan'),
+}
+
+QUICK_CASES = ('small-static', 'small-alpha-pan')
+
+MOTION_TYPES = ('static', 'pan', 'noise')
+
+# 缩放阶段的缩小比例（相当于 1080p → 480p）
+RESIZE_RATIO = 480 / 1080
+
+# 比较基线时超过该比例的变化视为回退
+DEFAULT_TOLERANCE = 0.10
+
+
+def make_frames(width: int, height: int, n_frames: int, alpha: bool, motion: str, seed: int = 0):
+    """逐帧生成合成画面
+
+    static: 渐变背景上只有一小块区域闪烁，底部进度条逐帧增长；pan: 色块横向移动；
+    noise: 整帧渐变平移并叠加噪声（每个像素都在变化）。
+    每一帧都与上一帧不同，避免 APNG 编码时合并相同的帧。
+    """
+    if motion not in MOTION_TYPES:
+        raise ValueError(f"不支持的运动类型: {motion}")
+
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    background = np.stack([
+        (xx * 255 // max(width - 1, 1)),
+        (yy * 255 // max(height - 1, 1)),
+        np.full_like(xx, 128),
+    ], axis=-1).astype(np.uint8)
+
+    if alpha:
+        # 中心不透明、边缘渐隐的椭圆
+        distance = np.hypot((xx - width / 2) / (width / 2), (yy - height / 2) / (height / 2))
+        alpha_channel = (np.clip(1.2 - distance, 0, 1) * 255).astype(np.uint8)
+
+    block = max(8, min(width, height) // 6)
+    for i in range(n_frames):
+        if motion == 'noise':
+            frame = np.roll(background, i * 4, axis=1)
+            noise = rng.integers(-12, 13, size=frame.shape, dtype=np.int16)
+            frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        else:
+            frame = background.copy()
+            if motion == 'static':
+                x, y = width // 8, height // 8
+                frame[y:y + block, x:x + block] = (255, 255, 255) if i % 10 < 5 else (0, 0, 0)
+                frame[-2:, :(i + 1) * width // n_frames] = (255, 255, 255)
+            else:
+                x = (i * (width - block) // max(n_frames - 1, 1))
+                y = (height - block) // 2
+                frame[y:y + block, x:x + block] = (240, 80, 40)
+
+        if alpha:
+            frame = np.dstack([frame, alpha_channel])
+        yield Image.fromarray(frame)
+
+
+def make_synthetic_apng(path, width: int, height: int, n_frames: int,
+                        alpha: bool, motion: str, fps: float = 15) -> Path:
+    """生成合成 APNG 文件"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    frames = make_frames(width, height, n_frames, alpha, motion)
+    first = next(frames)
+    first.save(path, format='PNG', save_all=True, append_images=list(frames),
+               duration=int(1000 / fps), loop=0)
+    return path
+
+
+def timed(func: Callable, *args, repeat: int = 1):
+    """以 args 为参数运行 func repeat 次，返回 (最短耗时, 最后一次的返回值)"""
+    best = None
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, value
+
+
+def resize_all(frames: List[Image.Image], size: Tuple[int, int], engine: str) -> list:
+    """用指定引擎缩放全部帧"""
+    return [resize_frame(frame, size, engine) for frame in frames]
+
+
+def encode_all(make_writer: Callable, frames: List[Image.Image]):
+    """创建写入器并写入全部帧"""
+    writer = make_writer()
+    for frame in frames:
+        writer.add(frame)
+    return writer.close()
+
+
+def run_case(name: str, input_file: str, work_dir: str, workers: int, repeat: int) -> dict:
+    """在独立子进程中运行单个素材的全部测量，峰值内存只反映该素材"""
+    output_dir = Path(work_dir) / f"{name}_output"
+    shutil.rmtree(output_dir, ignore_errors=True)
+    output_dir.mkdir(parents=True)
+
+    processor = APNGProcessor(input_file, str(output_dir), workers=workers)
+    info = processor.analyze_apng()
+    n_frames = info['n_frames']
+    width, height = info['size']
+    # MB/秒按解码后的 RGBA 像素数据量计算
+    raw_mb = width * height * 4 * n_frames / (1024 * 1024)
+
+    stages = {}
+
+    def record(stage: str, seconds: float):
+        stages[stage] = {
+            'seconds': seconds,
+            'fps': n_frames / seconds if seconds else None,
+            'mb_per_sec': raw_mb / seconds if seconds else None,
+        }
+
+    seconds, _ = timed(lambda: sum(1 for _ in processor.iter_frames()), repeat=repeat)
+    record('decode', seconds)
+
+    # 解码 + 合成，结果供下面的编码器复用
+    seconds, frames = timed(lambda: list(processor.iter_prepared_frames()), repeat=repeat)
+    record('prepare', seconds)
+
+    # 各缩放引擎把准备好的帧按 RESIZE_RATIO 缩小
+    target = even_size((round(width * RESIZE_RATIO), round(height * RESIZE_RATIO)))
+    for engine in RESIZE_ENGINES:
+        if engine == 'auto':
+            continue
+        seconds, _ = timed(resize_all, frames, target, engine, repeat=repeat)
+        record(f"resize_{engine}", seconds)
+
+    writers = {
+        'gif': lambda: GIFWriter(str(output_dir / "stage.gif")),
+        'webp': lambda: WebPWriter(str(output_dir / "stage.webp")),
+        'mp4': lambda: MP4Writer(str(output_dir / "stage.mp4")),
+    }
+    for format_name, make_writer in writers.items():
+        seconds, _ = timed(encode_all, make_writer, frames, repeat=repeat)
+        record(f"encode_{format_name}", seconds)
+    del frames
+
+    def pipeline():
+        return APNGProcessor(input_file, str(output_dir), workers=workers).process_all()
+    seconds, results = timed(pipeline, repeat=repeat)
+    record('pipeline', seconds)
+
+    return {
+        'input': {
+            'size': [width, height],
+            'n_frames': n_frames,
+            'size_bytes': Path(input_file).stat().st_size,
+            'raw_mb': raw_mb,
+        },
+        'stages': stages,
+        'pipeline_stages': results.get('stages', {}),
+        'outputs': {
+            format_name: Path(file_path).stat().st_size
+            for format_name, file_path in results['output_files'].items()
+        },
+        'quality': results.get('quality', {}),
+        'peak_rss_mb': peak_rss_mb()['self'],
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """与基线比较，返回回退列表 (素材, 指标, 基线值, 当前值, 变化比例)
+
+    吞吐量下降或输出变大、内存增加超过 tolerance 视为回退。
+    合成素材与基线不一致（如生成方式改变）时跳过该素材。
+    """
+    regressions = []
+    for name, case in current['cases'].items():
+        base = baseline.get('cases', {}).get(name)
+        if base is None:
+            continue
+        if base['input'] != case['input']:
+            print(f"⚠️  {name} 的素材与基线不一致，跳过比较")
+            continue
+
+        checks = []
+        for stage, values in case['stages'].items():
+            base_fps = base['stages'].get(stage, {}).get('fps')
+            if base_fps and values['fps']:
+                # 吞吐量越高越好，取反后统一按「增大为回退」判断
+                checks.append((f"{stage} 帧/秒", base_fps, values['fps'], base_fps / values['fps'] - 1))
+        for format_name, size in case['outputs'].items():
+            base_size = base['outputs'].get(format_name)
+            if base_size:
+                checks.append((f"{format_name} 大小", base_size, size, size / base_size - 1))
+        if base.get('peak_rss_mb') and case.get('peak_rss_mb'):
+            checks.append(("峰值内存 MB", base['peak_rss_mb'], case['peak_rss_mb'],
+                           case['peak_rss_mb'] / base['peak_rss_mb'] - 1))
+
+        for metric, base_value, value, change in checks:
+            if change > tolerance:
+                regressions.append((name, metric, base_value, value, change))
+    return regressions
+
+
+def print_case(name: str, case: dict, baseline_case: Optional[dict] = None):
+    print(f"\n📊 {name}: {case['input']['size'][0]}x{case['input']['size'][1]}, "
+          f"{case['input']['n_frames']} 帧, 峰值内存 {case['peak_rss_mb']:.1f} MB")
+    for stage, values in case['stages'].items():
+        line = (f"  {stage:<12} {values['seconds']:8.3f} 秒  "
+                f"{values['fps']:8.1f} 帧/秒  {values['mb_per_sec']:8.1f} MB/秒")
+        if baseline_case and stage in baseline_case['stages']:
+            base_fps = baseline_case['stages'][stage]['fps']
+            line += f"  ({(values['fps'] / base_fps - 1) * 100:+.1f}%)"
+        print(line)
+    sizes = ", ".join(f"{fmt.upper()} {size / 1024:.1f} KB" for fmt, size in case['outputs'].items())
+    print(f"  输出大小: {sizes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APNG 处理管线基准测试")
+    parser.add_argument("--cases", nargs="+", choices=list(DEFAULT_CASES),
+                        help="只运行指定的素材 (默认: 全部)")
+    parser.add_argument("--quick", action="store_true", help="只运行小尺寸素材")
+    parser.add_argument("--repeat", type=int, default=1, help="每项测量重复次数，取最短耗时")
+    parser.add_argument("--workers", type=int, default=1, help="逐帧处理的并行进程数 (默认: 1)")
+    parser.add_argument("--work-dir", default="benchmark_work", help="合成素材和输出的目录")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="结果 JSON 文件")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线文件")
+    parser.add_argument("--compare", help="与指定的基线文件比较")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="比较基线时允许的变化比例 (默认: 0.10)")
+
+    args = parser.parse_args()
+
+    names = args.cases or (list(QUICK_CASES) if args.quick else list(DEFAULT_CASES))
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print("⏱️  APNG 处理管线基准测试")
+    print("=" * 30)
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'repeat': args.repeat,
+        'cases': {},
+    }
+
+    # spawn 启动全新的子进程，每个素材的峰值内存互不影响
+    context = multiprocessing.get_context('spawn')
+    for name in names:
+        width, height, n_frames, alpha, motion = DEFAULT_CASES[name]
+        input_file = work_dir / f"{name}.png"
+        if not input_file.exists():
+            print(f"🎨 生成合成素材: {input_file}")
+            make_synthetic_apng(input_file, width, height, n_frames, alpha, motion)
+
+        print(f"🚀 运行: {name}")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            case = executor.submit(run_case, name, str(input_file), str(work_dir),
+                                   args.workers, args.repeat).result()
+        case['params'] = {'alpha': alpha, 'motion': motion}
+        report['cases'][name] = case
+
+    for name, case in report['cases'].items():
+        print_case(name, case, baseline['cases'].get(name) if baseline else None)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📋 结果已保存: {args.output}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📌 基线已保存: {args.save_baseline}")
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n⚠️  发现 {len(regressions)} 项超过 {args.tolerance * 100:.0f}% 的回退:")
+            for name, metric, base_value, value, change in regressions:
+                print(f"  {name} {metric}: {base_value:.2f} → {value:.2f} ({change * 100:+.1f}%)")
+            return 1
+        print(f"\n✅ 与基线相比没有超过 {args.tolerance * 100:.0f}% 的回退")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+构建缓存
+以「源文件内容哈希 + 完整处理参数」为键缓存输出文件，
+源文件和参数都没变时直接复用上次的结果，不再重新编码。
+缓存超过容量上限时按最近使用时间（LRU）淘汰。
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+# 处理逻辑变化导致输出不同时递增，使旧缓存失效
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = Path(os.environ.get(
+    'APNG_CACHE_DIR', Path.home() / '.cache' / 'apng-processor'
+))
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_hash(path, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb: float = 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def make_key(self, input_file, options: dict) -> str:
+        """缓存键：源文件哈希 + 处理参数"""
+        payload = json.dumps({
+            'version': CACHE_VERSION,
+            'source': file_hash(input_file),
+            'options': options,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str, output_dir) -> Optional[dict]:
+        """命中时把缓存的文件复制到输出目录，返回记录的结果；未命中返回 None"""
+        entry = self.cache_dir / key
+        manifest_path = entry / MANIFEST_NAME
+        if not manifest_path.exists():
+            return None
+
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            for name in manifest['files']:
+                shutil.copyfile(entry / name, output_dir / name)
+        except (OSError, ValueError, KeyError):
+            # 缓存条目损坏，删除后按未命中处理
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        # 更新访问时间，用于 LRU 淘汰
+        os.utime(manifest_path)
+        return manifest['results']
+
+    def put(self, key: str, files, results: dict):
+        """把输出文件和结果写入缓存，写入完成后再原子地替换条目"""
+        entry = self.cache_dir / key
+        tmp_entry = Path(tempfile.mkdtemp(prefix=f".{key[:16]}-", dir=self.cache_dir))
+
+        try:
+            names = []
+            for file_path in files:
+                file_path = Path(file_path)
+                shutil.copyfile(file_path, tmp_entry / file_path.name)
+                names.append(file_path.name)
+
+            with open(tmp_entry / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+                json.dump({'files': names, 'results': results}, f, ensure_ascii=False, default=str)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            raise
+
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.replace(tmp_entry, entry)
+        except OSError:
+            # 其他进程（如批量处理）同时写入了相同的条目，保留对方的结果
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self.evict()
+
+    def evict(self):
+        """缓存总大小超过上限时，删除最久未使用的条目"""
+        entries = []
+        total_size = 0
+        for entry in self.cache_dir.iterdir():
+            if entry.name.startswith('.'):
+                # 其他进程正在写入的临时条目
+                continue
+            manifest_path = entry / MANIFEST_NAME
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+                last_used = manifest_path.stat().st_mtime
+            except OSError:
+                # 未写完或正在被其他进程删除的条目
+                continue
+            entries.append((last_used, size, entry))
+            total_size += size
+
+        entries.sort()
+        for _, size, entry in entries:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
@@ -3,9 +3,28 @@
 检查 APNG 文件的尺寸和宽高比
 """
 
+import sys
 from PIL import Image
 from pathlib import Path
 
+# 添加当前目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apng_parser import is_png, parse_apng
+
+
+def read_image_info(input_file: str) -> dict:
+    """读取尺寸和帧信息：PNG/APNG 只解析块结构，其他格式回退到 Pillow"""
+    if is_png(input_file):
+        return parse_apng(input_file)
+
+    with Image.open(input_file) as img:
+        return {
+            'size': img.size,
+            'is_animated': getattr(img, 'is_animated', False),
+            'n_frames': getattr(img, 'n_frames', 1),
+        }
+
 def check_apng_dimensions():
     input_file = "../out/index/images/index/u1_original.png"
     
@@ -14,41 +33,42 @@ def check_apng_dimensions():
         return
     
     try:
-        with Image.open(input_file) as img:
-            width, height = img.size
-            aspect_ratio = width / height
-            
-            print(f"📊 原图信息:")
-            print(f"  尺寸: {width} x {height}")
-            print(f"  宽高比: {aspect_ratio:.3f}")
-            print(f"  是否为动图: {getattr(img, 'is_animated', False)}")
-            if hasattr(img, 'n_frames'):
-                print(f"  帧数: {img.n_frames}")
-            
-            # 计算不同目标高度下的宽度（保持宽高比）
-            target_heights = [480, 720, 1080, 1440]
-            
-            print(f"\n🎯 保持宽高比的推荐尺寸:")
-            for target_height in target_heights:
-                target_width = int(target_height * aspect_ratio)
-                # 确保宽度是偶数（视频编码要求）
-                if target_width % 2 != 0:
-                    target_width += 1
-                print(f"  {target_width} x {target_height} ({target_height}p)")
-            
-            # 计算不同目标宽度下的高度
-            target_widths = [854, 1280, 1920, 2560]
-            
-            print(f"\n🎯 保持宽高比的其他选项:")
-            for target_width in target_widths:
-                target_height = int(target_width / aspect_ratio)
-                # 确保高度是偶数
-                if target_height % 2 != 0:
-                    target_height += 1
-                print(f"  {target_width} x {target_height}")
-            
-            return width, height, aspect_ratio
-            
+        info = read_image_info(input_file)
+        width, height = info['size']
+        aspect_ratio = width / height
+        
+        print(f"📊 原图信息:")
+        print(f"  尺寸: {width} x {height}")
+        print(f"  宽高比: {aspect_ratio:.3f}")
+        print(f"  是否为动图: {info['is_animated']}")
+        print(f"  帧数: {info['n_frames']}")
+        if 'total_duration' in info:
+            print(f"  总时长: {info['total_duration']:.0f} ms ({info['fps']:.1f} fps)")
+        
+        # 计算不同目标高度下的宽度（保持宽高比）
+        target_heights = [480, 720, 1080, 1440]
+        
+        print(f"\n🎯 保持宽高比的推荐尺寸:")
+        for target_height in target_heights:
+            target_width = int(target_height * aspect_ratio)
+            # 确保宽度是偶数（视频编码要求）
+            if target_width % 2 != 0:
+                target_width += 1
+            print(f"  {target_width} x {target_height} ({target_height}p)")
+        
+        # 计算不同目标宽度下的高度
+        target_widths = [854, 1280, 1920, 2560]
+        
+        print(f"\n🎯 保持宽高比的其他选项:")
+        for target_width in target_widths:
+            target_height = int(target_width / aspect_ratio)
+            # 确保高度是偶数
+            if target_height % 2 != 0:
+                target_height += 1
+            print(f"  {target_width} x {target_height}")
+        
+        return width, height, aspect_ratio
+        
     except Exception as e:
         print(f"❌ 分析失败: {e}")
         return None
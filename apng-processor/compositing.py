@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+透明度合成
+把带透明通道的帧合成到纯色背景（matte）上，convert_to_jpg、create_gif 和流式管线共用。
+每种尺寸的背景只创建一次，之后逐帧复制复用；RGBA 帧直接作为自身的蒙版，
+不再为 split() 分配四个通道的整帧缓冲区。
+支持透明度的格式（WebP、APNG）可以保留透明通道，不做合成。
+"""
+
+import re
+import threading
+from typing import Tuple
+
+from PIL import Image
+
+DEFAULT_MATTE = (255, 255, 255)
+
+
+def parse_color(text: str) -> Tuple[int, int, int]:
+    """解析颜色，支持 #RRGGBB、RRGGBB 和 R,G,B 写法"""
+    text = text.strip()
+    match = re.fullmatch(r'#?([0-9a-fA-F]{6})', text)
+    if match:
+        value = match.group(1)
+        return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+    parts = text.split(',')
+    if len(parts) == 3 and all(part.strip().isdigit() for part in parts):
+        color = tuple(int(part) for part in parts)
+        if all(0 <= channel <= 255 for channel in color):
+            return color
+
+    raise ValueError(f"无法解析的颜色: {text}")
+
+
+class Compositor:
+    """matte 合成器：按尺寸缓存背景图像，逐帧复用"""
+
+    def __init__(self, matte: Tuple[int, int, int] = DEFAULT_MATTE):
+        self.matte = tuple(matte)
+        self.backgrounds = {}
+
+    def background(self, size: Tuple[int, int]) -> Image.Image:
+        if size not in self.backgrounds:
+            self.backgrounds[size] = Image.new('RGB', size, self.matte)
+        return self.backgrounds[size]
+
+    def composite(self, frame: Image.Image, keep_alpha: bool = False) -> Image.Image:
+        """返回合成后的 RGB 帧；keep_alpha 为 True 时返回保留透明通道的 RGBA 帧"""
+        if keep_alpha:
+            return frame if frame.mode == 'RGBA' else frame.convert('RGBA')
+
+        if frame.mode == 'RGB':
+            return frame
+        if frame.mode not in ('RGBA', 'LA', 'P', 'PA'):
+            return frame.convert('RGB')
+        if frame.mode != 'RGBA':
+            frame = frame.convert('RGBA')
+
+        output = self.background(frame.size).copy()
+        # RGBA 图像作为蒙版时直接使用其透明通道
+        output.paste(frame, mask=frame)
+        return output
+
+
+_local = threading.local()
+
+
+def composite_frame(frame: Image.Image, matte: Tuple[int, int, int] = DEFAULT_MATTE,
+                    keep_alpha: bool = False) -> Image.Image:
+    """使用当前线程（进程）缓存的合成器合成单帧"""
+    compositors = getattr(_local, 'compositors', None)
+    if compositors is None:
+        compositors = _local.compositors = {}
+    matte = tuple(matte)
+    if matte not in compositors:
+        compositors[matte] = Compositor(matte)
+    return compositors[matte].composite(frame, keep_alpha)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+内存映射帧存储
+需要保留全部帧时（多格式输出、质量搜索等），把帧写入临时文件上的
+(n, h, w, c) uint8 内存映射数组，而不是在 Python 堆中保存 PIL 图像列表。
+帧数据由操作系统按需换入换出，长动画也能在内存较小的机器上处理。
+传给子进程时只序列化文件路径和形状，子进程直接映射同一个文件，不复制像素数据。
+
+它是溢出到磁盘的帧缓冲区，目前用于 --mmap-frames（WebP 搜索和保留帧的流程），主流程的编码器不经过它。
+RGBA / L 帧读取时直接映射为只读 PIL 图像，不复制像素；Pillow 内部的 RGB 每像素占 4 字节，
+与存储的 3 通道布局不同，RGB 帧读取时复制一次（只复制这一帧）。
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+from typing import Iterator, Optional, Tuple
+
+from PIL import Image
+
+from lazy_imports import LazyModule
+
+np = LazyModule('numpy')
+
+# 通道数 → PIL 模式
+CHANNEL_MODES = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+MODE_CHANNELS = {mode: channels for channels, mode in CHANNEL_MODES.items()}
+
+# 可以直接映射为 PIL 图像（不复制）的模式
+ZERO_COPY_MODES = ('L', 'RGBA')
+
+
+class FrameStore:
+    """固定形状的帧序列，支持 len()、下标访问和迭代（产出 PIL 图像）
+
+    写入全部帧后调用一次 flush()；之后可以传给子进程，序列化时不再逐次刷新。
+    """
+
+    def __init__(self, count: int, size: Tuple[int, int], mode: str = 'RGB',
+                 directory: Optional[str] = None):
+        if mode not in MODE_CHANNELS:
+            raise ValueError(f"不支持的帧模式: {mode}")
+        width, height = size
+        self.mode = mode
+        self.shape = (count, height, width, MODE_CHANNELS[mode])
+        self.length = 0
+        self.owner = True
+
+        fd, self.path = tempfile.mkstemp(prefix="apng-frames-", suffix=".raw", dir=directory)
+        os.close(fd)
+        self.array = np.memmap(self.path, dtype=np.uint8, mode='w+', shape=self.shape)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.shape[2], self.shape[1]
+
+    def append(self, frame: Image.Image) -> int:
+        """写入下一帧，返回帧序号；尺寸或模式不同时先转换"""
+        if self.length >= self.shape[0]:
+            raise Exception("帧存储已满")
+        if frame.mode != self.mode:
+            frame = frame.convert(self.mode)
+        if frame.size != self.size:
+            raise ValueError(f"帧尺寸 {frame.size} 与存储尺寸 {self.size} 不一致")
+
+        array = np.asarray(frame)
+        self.array[self.length] = array.reshape(self.shape[1:])
+        self.length += 1
+        return self.length - 1
+
+    def frame(self, index: int) -> Image.Image:
+        if not -self.length <= index < self.length:
+            raise IndexError(index)
+        array = self.array[index % self.length]
+        if self.mode in ZERO_COPY_MODES:
+            # 布局与 Pillow 内部一致，直接映射；修改图像时 Pillow 会先复制一份
+            return Image.frombuffer(self.mode, self.size, array, 'raw', self.mode, 0, 1)
+        return Image.fromarray(array, self.mode)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __bool__(self) -> bool:
+        return self.length > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.frame(i) for i in range(*index.indices(self.length))]
+        return self.frame(index)
+
+    def __iter__(self) -> Iterator[Image.Image]:
+        for i in range(self.length):
+            yield self.frame(i)
+
+    def ref(self, index: int) -> 'FrameRef':
+        """可传给子进程的帧引用"""
+        return FrameRef(self, index)
+
+    def flush(self):
+        """把写入的帧刷新到文件，写入结束后调用一次"""
+        self.array.flush()
+
+    def close(self):
+        """释放映射；创建者负责删除临时文件"""
+        self.array = None
+        if self.owner and self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError:
+                # Windows 下仍有视图引用映射时无法删除，留给系统临时目录清理
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __getstate__(self):
+        # 只传递文件路径和形状，子进程重新映射同一个文件；
+        # 共享映射对其他进程立即可见，写入结束时已经 flush 过，这里不再逐次刷新
+        return {'path': self.path, 'shape': self.shape, 'mode': self.mode, 'length': self.length}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.shape = state['shape']
+        self.mode = state['mode']
+        self.length = state['length']
+        self.owner = False
+        self.array = np.memmap(self.path, dtype=np.uint8, mode='r', shape=self.shape)
+
+
+class FrameRef:
+    """帧存储中某一帧的引用，序列化时不包含像素数据"""
+
+    def __init__(self, store: FrameStore, index: int):
+        self.store = store
+        self.index = index
+
+    def load(self) -> Image.Image:
+        return self.store.frame(self.index)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+按需导入第三方依赖
+NumPy、OpenCV、tqdm 在第一次使用时才导入：查看帮助、只读取文件信息或只输出 WebP 时，
+启动开销只有 Pillow 本身；缺少某个依赖时，只有真正用到它的功能才会失败，
+并给出需要安装的包名，而不是在导入模块时直接退出。
+"""
+
+import sys
+import importlib
+import importlib.util
+from typing import Iterable
+
+# 模块名 → pip 包名
+PACKAGES = {
+    'numpy': 'numpy',
+    'cv2': 'opencv-python',
+    'tqdm': 'tqdm',
+    'PIL': 'Pillow',
+}
+
+
+class MissingDependency(ImportError):
+    """缺少某个功能需要的第三方库"""
+
+    def __init__(self, names: Iterable[str]):
+        self.names = list(names)
+        packages = " ".join(PACKAGES.get(name, name) for name in self.names)
+        super().__init__(f"缺少依赖库: {', '.join(self.names)}，请运行: pip install {packages}"
+                         f" (或 pip install -r requirements.txt)")
+
+
+def has_module(name: str) -> bool:
+    """模块是否可以导入（只查找，不执行导入）"""
+    if sys.modules.get(name) is not None:
+        return True
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def require(*names: str):
+    """检查依赖是否都已安装，缺少时抛出 MissingDependency"""
+    missing = [name for name in names if not has_module(name)]
+    if missing:
+        raise MissingDependency(missing)
+
+
+class LazyModule:
+    """模块代理：第一次访问属性时才导入真正的模块
+
+    导入后把模块的属性复制到代理自身，之后的属性访问不再经过 __getattr__。
+    使用代理的模块需要 `from __future__ import annotations`，避免类型注解在定义时求值。
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def _load(self):
+        try:
+            module = importlib.import_module(self._name)
+        except ImportError as e:
+            raise MissingDependency([self._name]) from e
+        self.__dict__.update(module.__dict__)
+        return module
+
+    def __getattr__(self, attr: str):
+        if attr.startswith('__') and attr.endswith('__'):
+            # 不为 copy / pickle 等探测的特殊属性触发导入
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        loaded = '已导入' if '__name__' in self.__dict__ else '未导入'
+        return f"<LazyModule {self._name} ({loaded})>"
+
+
+def progress(iterable, **kwargs):
+    """tqdm 进度条；未安装 tqdm 时直接返回原迭代对象"""
+    if not has_module('tqdm'):
+        return iterable
+    from tqdm import tqdm
+    return tqdm(iterable, **kwargs)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+管线统计
+记录各阶段耗时、读写字节数和峰值内存，写入 compression_report.json，
+便于在不同构建之间追踪性能回退，找出各类素材上最耗时的阶段。
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块
+    resource = None
+
+
+def _windows_peak_rss() -> Optional[int]:
+    """Windows 下通过 GetProcessMemoryInfo 读取当前进程的峰值工作集（字节）"""
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    except Exception:
+        return None
+
+
+def peak_rss_mb() -> dict:
+    """返回峰值常驻内存（MB）：self 为当前进程，children 为已结束的子进程中的最大值
+
+    无法获取时对应的值为 None。
+    """
+    if resource is None:
+        peak = _windows_peak_rss()
+        return {'self': peak / (1024 * 1024) if peak is not None else None, 'children': None}
+
+    # Linux 下 ru_maxrss 单位为 KB，macOS 下为字节
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / (1024 * 1024),
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / (1024 * 1024),
+    }
+
+
+class PipelineStats:
+    """累计各阶段耗时和读写字节数
+
+    逐帧阶段（解码、合成、缩放等）按帧累计；并行执行时各阶段之和可能超过总耗时。
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add(self, name: str, seconds: float, calls: int = 1):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        stage['seconds'] += seconds
+        stage['calls'] += calls
+
+    @contextmanager
+    def measure(self, name: str):
+        """计时上下文：with stats.measure('analyze'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def as_dict(self) -> dict:
+        return {
+            'stages': self.stages,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_rss_mb': peak_rss_mb(),
+        }
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+封面帧与占位图
+在流式管线中顺带挑选一帧作为封面（first 第一帧 / representative 最有代表性 / sharpest 最清晰），
+输出小体积的 poster.webp / poster.jpg、可以直接内联的 base64 小图（data URL）和 BlurHash，
+并写入 poster.json 清单，页面在动图加载完成前先显示占位图和封面，改善首屏绘制（LCP）。
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import base64
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from compositing import DEFAULT_MATTE, composite_frame
+from lazy_imports import LazyModule
+from quality_metrics import analysis_size, sample_indices, to_luma
+
+np = LazyModule('numpy')
+
+POSTER_STRATEGIES = ('first', 'representative', 'sharpest')
+
+# representative 策略保留的候选帧数（均匀抽样，只有候选帧保存完整画面）
+POSTER_CANDIDATES = 8
+
+# representative 策略比较画面时使用的缩略图长边
+THUMBNAIL_SIZE = 32
+
+# 内联占位图的长边（像素）和 BlurHash 的分量数
+PLACEHOLDER_SIZE = 16
+BLURHASH_COMPONENTS = (4, 3)
+
+POSTER_JPEG_QUALITY = 70
+POSTER_WEBP_QUALITY = 70
+PLACEHOLDER_QUALITY = 50
+
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def sharpness(luma: np.ndarray) -> float:
+    """清晰度：拉普拉斯响应的方差，越大细节越多、运动模糊越少"""
+    laplacian = (luma[1:-1, :-2] + luma[1:-1, 2:] + luma[:-2, 1:-1] + luma[2:, 1:-1]
+                 - 4 * luma[1:-1, 1:-1])
+    return float(laplacian.var()) if laplacian.size else 0.0
+
+
+def thumbnail(frame: Image.Image, size: Tuple[int, int],
+              matte: Tuple[int, int, int] = DEFAULT_MATTE) -> np.ndarray:
+    """合成到 matte 背景后缩小为 float32 RGB 数组"""
+    frame = composite_frame(frame, matte)
+    return np.asarray(frame.resize(size, Image.Resampling.BOX), dtype=np.float32)
+
+
+class PosterPicker:
+    """在流式管线中挑选封面帧
+
+    first 只保存第一帧；sharpest 逐帧计算清晰度，只保留当前最清晰的一帧；
+    representative 为每帧保存很小的缩略图，并保存均匀抽样的候选帧，
+    结束后选出与所有帧平均差异最小的候选帧（限定在候选帧中的 medoid）。
+    """
+
+    def __init__(self, total_frames: int, strategy: str = 'representative',
+                 matte: Tuple[int, int, int] = DEFAULT_MATTE,
+                 candidates: int = POSTER_CANDIDATES):
+        if strategy not in POSTER_STRATEGIES:
+            raise ValueError(f"不支持的封面帧策略: {strategy}")
+        self.strategy = strategy
+        self.matte = matte
+        self.candidate_indices = set(sample_indices(total_frames, candidates))
+        self.candidates = {}
+        self.thumbnails: List[np.ndarray] = []
+        self.thumbnail_size = None
+        self.best = None
+        self.best_score = None
+
+    @property
+    def done(self) -> bool:
+        """是否已经不需要更多的帧（first 策略拿到第一帧即可）"""
+        return self.strategy == 'first' and self.best is not None
+
+    def add(self, index: int, frame: Image.Image):
+        if self.strategy == 'first':
+            if self.best is None:
+                self.best = (index, frame)
+        elif self.strategy == 'sharpest':
+            score = sharpness(to_luma(frame, analysis_size(frame.size), self.matte))
+            if self.best_score is None or score > self.best_score:
+                self.best, self.best_score = (index, frame), score
+        else:
+            if self.thumbnail_size is None:
+                self.thumbnail_size = analysis_size(frame.size, THUMBNAIL_SIZE)
+            self.thumbnails.append(thumbnail(frame, self.thumbnail_size, self.matte))
+            if index in self.candidate_indices:
+                self.candidates[index] = frame
+
+    def wrap(self, frames: Iterable[Image.Image]) -> Iterator[Image.Image]:
+        """原样产出帧，顺带记录封面帧候选"""
+        for i, frame in enumerate(frames):
+            self.add(i, frame)
+            yield frame
+
+    def result(self) -> Tuple[int, Image.Image]:
+        """返回 (帧序号, 帧)"""
+        if self.strategy != 'representative':
+            if self.best is None:
+                raise Exception("没有可用的帧")
+            return self.best
+
+        if not self.candidates:
+            raise Exception("没有可用的帧")
+        stack = np.stack(self.thumbnails)
+        best_index = min(self.candidates,
+                         key=lambda i: float(np.mean((stack - self.thumbnails[i]) ** 2)))
+        return best_index, self.candidates[best_index]
+
+
+def _encode83(value: int, length: int) -> str:
+    return "".join(BASE83[value // 83 ** (length - 1 - i) % 83] for i in range(length))
+
+
+def _srgb_to_linear(array: np.ndarray) -> np.ndarray:
+    array = array / 255.0
+    return np.where(array <= 0.04045, array / 12.92, ((array + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb(value: float) -> int:
+    value = min(max(value, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def encode_blurhash(frame: Image.Image, components: Tuple[int, int] = BLURHASH_COMPONENTS,
+                    matte: Tuple[int, int, int] = DEFAULT_MATTE) -> str:
+    """BlurHash 编码（https://blurha.sh 的标准算法），先缩小到 64 像素以内再计算"""
+    components_x, components_y = components
+    frame = composite_frame(frame, matte)
+    frame = frame.resize(analysis_size(frame.size, 64), Image.Resampling.BOX)
+    linear = _srgb_to_linear(np.asarray(frame, dtype=np.float64))
+    height, width = linear.shape[:2]
+
+    factors = []
+    for j in range(components_y):
+        for i in range(components_x):
+            basis = (np.cos(np.pi * j * np.arange(height) / height)[:, None] *
+                     np.cos(np.pi * i * np.arange(width) / width)[None, :])
+            normalisation = 1 if i == 0 and j == 0 else 2
+            factors.append(normalisation * (basis[..., None] * linear).sum(axis=(0, 1)) / (width * height))
+
+    dc, ac = factors[0], factors[1:]
+    blurhash = _encode83((components_x - 1) + (components_y - 1) * 9, 1)
+    if ac:
+        quantised_max = int(max(0, min(82, np.floor(max(np.abs(value).max() for value in ac) * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    blurhash += _encode83(quantised_max, 1)
+    blurhash += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) +
+                          _linear_to_srgb(dc[2]), 4)
+    for value in ac:
+        quantised = [int(max(0, min(18, np.floor(np.sign(v) * abs(v / max_value) ** 0.5 * 9 + 9.5))))
+                     for v in value]
+        blurhash += _encode83(quantised[0] * 19 * 19 + quantised[1] * 19 + quantised[2], 2)
+    return blurhash
+
+
+def placeholder_data_url(frame: Image.Image, size: int = PLACEHOLDER_SIZE,
+                         matte: Tuple[int, int, int] = DEFAULT_MATTE) -> dict:
+    """长边 size 像素的 WebP 小图，返回 {'width', 'height', 'data_url', 'bytes'}"""
+    small = composite_frame(frame, matte).resize(analysis_size(frame.size, size), Image.Resampling.BOX)
+    buffer = io.BytesIO()
+    small.save(buffer, format='WEBP', quality=PLACEHOLDER_QUALITY, method=6)
+    data = buffer.getvalue()
+    return {
+        'width': small.width,
+        'height': small.height,
+        'data_url': "data:image/webp;base64," + base64.b64encode(data).decode('ascii'),
+        'bytes': len(data),
+    }
+
+
+def write_poster(frame: Image.Image, output_dir, index: int, strategy: str,
+                 durations: Optional[List[float]] = None,
+                 matte: Tuple[int, int, int] = DEFAULT_MATTE,
+                 source: Optional[str] = None,
+                 animations: Optional[dict] = None) -> dict:
+    """写出 poster.webp / poster.jpg 和 poster.json，返回清单内容
+
+    WebP 封面保留透明通道，JPEG 合成到 matte 背景上。
+    animations 为 {格式: 文件名}，写入清单供页面在封面之后加载。
+    """
+    output_dir = Path(output_dir)
+    webp_path = output_dir / "poster.webp"
+    jpg_path = output_dir / "poster.jpg"
+    frame.save(webp_path, format='WEBP', quality=POSTER_WEBP_QUALITY, method=6)
+    composite_frame(frame, matte).save(jpg_path, format='JPEG', quality=POSTER_JPEG_QUALITY,
+                                       optimize=True, progressive=True)
+
+    manifest = {
+        'source': source,
+        'width': frame.width,
+        'height': frame.height,
+        'strategy': strategy,
+        'frame': index,
+        # 封面帧在动画中的开始时间，可用于视频的 poster 或从该时刻开始播放
+        'time_ms': round(sum(durations[:index])) if durations and len(durations) > index else None,
+        'poster': {
+            'webp': {'path': webp_path.name, 'bytes': webp_path.stat().st_size},
+            'jpg': {'path': jpg_path.name, 'bytes': jpg_path.stat().st_size},
+        },
+        'placeholder': placeholder_data_url(frame, matte=matte),
+        'blurhash': encode_blurhash(frame, matte=matte),
+        'animations': animations or {},
+    }
+    manifest_path = output_dir / "poster.json"
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
@@ -46,7 +46,6 @@ def main():
     
     print("🔧 处理配置:")
     print("  - 输出目录: u1_webp_compressed/")
-    print("  - JPG 质量: 80")
     print(f"  - 目标尺寸: {target_width}x{target_height} (保持宽高比)")
     print("  - WebP 帧率: 15 fps")
     print("  - MP4 帧率: 24 fps")
@@ -66,11 +65,8 @@ def main():
         # 2. 提取帧
         processor.extract_frames()
         
-        # 3. 转换为 JPG
-        jpg_paths = processor.convert_to_jpg(
-            quality=80, 
-            resize=(target_width, target_height)
-        )
+        # 3. 在内存中准备帧（不写出 JPG 中间文件）
+        processor.prepare_frames(resize=(target_width, target_height))
         
         # 4. 只创建 WebP 和 MP4
         output_files = {}
@@ -6,13 +6,15 @@
 
 import os
 import sys
+import argparse
 from pathlib import Path
 from PIL import Image
 
 # 添加当前目录到 Python 路径
 sys.path.insert(0, str(Path(__file__).parent))
 
-from apng_processor import APNGProcessor
+from apng_processor import APNGProcessor, RENDITION_FORMATS, RENDITION_HEIGHTS, RESAMPLE_MODES
+from webp_search import parse_size, search_webp
 
 def get_aspect_ratio_sizes(original_width, original_height):
     """计算保持宽高比的不同尺寸选项"""
@@ -57,12 +59,99 @@ def get_aspect_ratio_sizes(original_width, original_height):
     
     return options
 
+def run_search(input_file, output_dir, option, args, file_size_mb):
+    """非交互模式：搜索满足字节预算或质量下限的 WebP 参数"""
+    max_bytes = parse_size(args.max_bytes) if args.max_bytes else None
+    
+    print(f"\n🔎 搜索 WebP 编码参数:")
+    if max_bytes:
+        print(f"  - 字节预算: {max_bytes / (1024 * 1024):.2f} MB")
+    if args.min_ssim is not None:
+        print(f"  - SSIM 下限: {args.min_ssim}")
+    if args.min_psnr is not None:
+        print(f"  - PSNR 下限: {args.min_psnr} dB")
+    
+    processor = APNGProcessor(input_file, output_dir, mmap_frames=args.mmap_frames)
+    processor.analyze_apng()
+    try:
+        processor.extract_frames()
+        resize = (option['width'], option['height']) if option else None
+        # 帧只解码、缩放一次，搜索过程中的每次编码都复用
+        frames = processor.prepare_frames(resize=resize)
+        
+        output_path = Path(output_dir) / "compressed.webp"
+        result = search_webp(frames, str(output_path),
+                             max_bytes=max_bytes,
+                             min_ssim=args.min_ssim,
+                             min_psnr=args.min_psnr,
+                             fps=args.fps,
+                             durations=processor.frame_durations,
+                             resize_engine=processor.resize_engine,
+                             resample=args.resample)
+    finally:
+        processor.release_frames()
+    
+    size_mb = result['size_bytes'] / (1024 * 1024)
+    status = "✅" if result['met'] else "⚠️"
+    print(f"\n{status} 搜索完成 ({result['encodes']} 次编码)")
+    print(f"  尺寸: {result['size'][0]}x{result['size'][1]}")
+    print(f"  质量: {result['quality']}")
+    print(f"  大小: {size_mb:.2f} MB (压缩 {(1 - size_mb / file_size_mb) * 100:.1f}%)")
+    print(f"  SSIM: {result['ssim']:.4f}, PSNR: {result['psnr']:.2f} dB (抽样帧最低值)")
+    if not result['met']:
+        print("  未能同时满足所有约束，已输出最接近的结果")
+    print(f"\n📁 输出文件: {output_path.absolute()}")
+    
+    return 0 if result['met'] else 1
+
+def run_renditions(input_file, output_dir, args):
+    """一次解码生成全部尺寸，输出 srcset 清单"""
+    heights = [int(value) for value in args.renditions.split(',')]
+    formats = [value.strip() for value in args.formats.split(',')]
+    
+    print(f"\n🔧 处理配置:")
+    print(f"  - 输出目录: {output_dir}/")
+    print(f"  - 目标高度: {', '.join(f'{h}p' for h in heights)}")
+    print(f"  - 输出格式: {', '.join(formats)}")
+    
+    processor = APNGProcessor(input_file, output_dir)
+    manifest = processor.process_renditions(heights=heights, formats=formats)
+    
+    print(f"\n🖼️  srcset:")
+    for format_name, srcset in manifest['srcset'].items():
+        print(f"  {format_name}: {srcset}")
+    print(f"\n📁 所有文件保存在: {Path(output_dir).absolute()}")
+    
+    return 0
+
 def main():
+    parser = argparse.ArgumentParser(description="带选项的 APNG 处理脚本")
+    parser.add_argument("input", nargs="?", default="../out/index/images/index/u1_original.png",
+                        help="输入 APNG 文件路径")
+    parser.add_argument("--preset", choices=['ultra', 'high', 'medium', 'low'],
+                        help="直接使用指定的压缩选项，不再交互选择")
+    parser.add_argument("--max-bytes", help="WebP 字节预算，如 1.5MB、800KB（启用自动搜索）")
+    parser.add_argument("--min-ssim", type=float, help="WebP SSIM 下限，如 0.95（启用自动搜索）")
+    parser.add_argument("--min-psnr", type=float, help="WebP PSNR 下限 (dB)（启用自动搜索）")
+    parser.add_argument("--fps", type=float, default=15, help="自动搜索时的 WebP 帧率")
+    parser.add_argument("--resample", choices=RESAMPLE_MODES, default='nearest',
+                        help="自动搜索时把源时间轴重采样到 --fps 的方式 (none 为每帧按固定时长写入)")
+    parser.add_argument("--mmap-frames", action="store_true",
+                        help="自动搜索时把帧放入内存映射的临时文件，适合长动画和小内存机器")
+    parser.add_argument("--renditions", nargs="?", const=",".join(map(str, RENDITION_HEIGHTS)),
+                        help="一次生成多个尺寸 (逗号分隔的高度，默认 480,720,1080,1440)，并输出 srcset 清单")
+    parser.add_argument("--formats", default="webp",
+                        help=f"多尺寸模式的输出格式，逗号分隔 ({', '.join(RENDITION_FORMATS)})")
+    parser.add_argument("-o", "--output", help="输出目录")
+    args = parser.parse_args()
+    
+    search_mode = args.max_bytes or args.min_ssim is not None or args.min_psnr is not None
+    
     print("🎬 APNG 处理器 - 多选项版本")
     print("=" * 40)
     
     # 输入文件路径
-    input_file = "../out/index/images/index/u1_original.png"
+    input_file = args.input
     
     if not Path(input_file).exists():
         print(f"❌ 文件不存在: {input_file}")
@@ -83,6 +172,38 @@ def main():
     # 获取压缩选项
     options = get_aspect_ratio_sizes(original_width, original_height)
     
+    if args.renditions:
+        output_dir = args.output or "u1_renditions"
+        try:
+            return run_renditions(input_file, output_dir, args)
+        except Exception as e:
+            print(f"❌ 处理失败: {e}")
+            return 1
+    
+    if search_mode:
+        # 搜索模式：预设尺寸作为最大分辨率，未指定时从原始尺寸开始
+        option = options[args.preset] if args.preset else None
+        output_dir = args.output or "u1_compressed_search"
+        try:
+            return run_search(input_file, output_dir, option, args, file_size_mb)
+        except Exception as e:
+            print(f"❌ 处理失败: {e}")
+            return 1
+    
+    if args.preset:
+        selected_option = options[args.preset]
+    else:
+        selected_option = choose_option(options)
+    
+    print(f"\n✅ 选择: {selected_option['name']} - {selected_option['size']}")
+    
+    # 创建输出目录名
+    output_dir = args.output or f"u1_compressed_{selected_option['size'].replace('x', '_')}"
+    
+    return run_preset(input_file, output_dir, selected_option, original_width, original_height, file_size_mb)
+
+def choose_option(options):
+    """交互选择压缩选项"""
     print("🎯 可用的压缩选项:")
     for i, (key, option) in enumerate(options.items(), 1):
         print(f"  {i}. {option['name']} - {option['size']}")
@@ -106,11 +227,10 @@ def main():
         print("\n使用默认选项")
         selected_option = options['high']
     
-    print(f"\n✅ 选择: {selected_option['name']} - {selected_option['size']}")
-    
-    # 创建输出目录名
-    output_dir = f"u1_compressed_{selected_option['size'].replace('x', '_')}"
-    
+    return selected_option
+
+def run_preset(input_file, output_dir, selected_option, original_width, original_height, file_size_mb):
+    """使用固定的压缩选项处理所有格式"""
     # 创建处理器
     processor = APNGProcessor(input_file, output_dir)
     
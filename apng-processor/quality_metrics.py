@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+感知质量指标
+向量化计算 PSNR / SSIM，比较源帧和编码后解码出的帧。
+比较前先缩小到分析尺寸，检查开销远小于一次编码。
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image, ImageSequence
+
+from compositing import DEFAULT_MATTE, composite_frame
+from lazy_imports import LazyModule
+
+np = LazyModule('numpy')
+cv2 = LazyModule('cv2')
+
+# 计算指标时图像长边的最大像素数
+ANALYSIS_SIZE = 256
+
+# 输出文件质量检查时默认抽样的源帧数
+REPORT_SAMPLE_FRAMES = 16
+
+# 使用 OpenCV 解码的视频格式
+VIDEO_SUFFIXES = ('.mp4', '.webm')
+
+# 两帧完全相同时 PSNR 为无穷大，统计时按该值计
+PSNR_CAP = 100.0
+
+# SSIM 常数（动态范围 255）
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+
+def analysis_size(size: Tuple[int, int], max_side: int = ANALYSIS_SIZE) -> Tuple[int, int]:
+    """按长边不超过 max_side 计算分析尺寸（不放大）"""
+    width, height = size
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def to_luma(frame: Image.Image, size: Optional[Tuple[int, int]] = None,
+            matte: Tuple[int, int, int] = DEFAULT_MATTE) -> np.ndarray:
+    """转换为指定尺寸的亮度通道 float32 数组；带透明通道的帧先合成到 matte 背景上
+
+    缩小时按盒式平均；放大（比较缩小编码的输出与原尺寸的源帧）时按浏览器显示的方式双线性插值。
+    """
+    frame = composite_frame(frame, matte)
+    if size is not None and frame.size != size:
+        enlarge = frame.width < size[0] or frame.height < size[1]
+        frame = frame.resize(size, Image.Resampling.BILINEAR if enlarge else Image.Resampling.BOX)
+    return np.asarray(frame.convert('L'), dtype=np.float32)
+
+
+def psnr(reference: np.ndarray, distorted: np.ndarray) -> float:
+    """峰值信噪比（dB），两帧完全相同时返回 inf"""
+    mse = np.mean((reference - distorted) ** 2)
+    if mse == 0:
+        return float('inf')
+    return float(10 * np.log10(255 ** 2 / mse))
+
+
+def ssim(reference: np.ndarray, distorted: np.ndarray) -> float:
+    """结构相似度，使用 11x11 高斯窗口（σ=1.5）"""
+    def blur(array):
+        return cv2.GaussianBlur(array, (11, 11), 1.5)
+
+    mu_x = blur(reference)
+    mu_y = blur(distorted)
+    mu_xx = mu_x * mu_x
+    mu_yy = mu_y * mu_y
+    mu_xy = mu_x * mu_y
+
+    sigma_xx = blur(reference * reference) - mu_xx
+    sigma_yy = blur(distorted * distorted) - mu_yy
+    sigma_xy = blur(reference * distorted) - mu_xy
+
+    ssim_map = ((2 * mu_xy + SSIM_C1) * (2 * sigma_xy + SSIM_C2)) / \
+               ((mu_xx + mu_yy + SSIM_C1) * (sigma_xx + sigma_yy + SSIM_C2))
+    return float(ssim_map.mean())
+
+
+def sample_indices(total: int, count: int) -> list:
+    """在 [0, total) 中均匀选取最多 count 个帧序号"""
+    if total <= count:
+        return list(range(total))
+    return sorted({int(i) for i in np.linspace(0, total - 1, count)})
+
+
+def compare_frames(reference: Image.Image, distorted: Image.Image,
+                   size: Optional[Tuple[int, int]] = None) -> dict:
+    """比较两帧，返回 {'ssim', 'psnr'}；size 为分析尺寸，默认按参考帧计算"""
+    size = size or analysis_size(reference.size)
+    reference = to_luma(reference, size)
+    distorted = to_luma(distorted, size)
+    return {'ssim': ssim(reference, distorted), 'psnr': psnr(reference, distorted)}
+
+
+class ReferenceSampler:
+    """在流式管线中抽样保存源帧（已合成、已缩放）的缩小亮度图，用于之后比较输出"""
+
+    def __init__(self, total_frames: int, sample_frames: int = REPORT_SAMPLE_FRAMES,
+                 matte: Tuple[int, int, int] = DEFAULT_MATTE):
+        self.indices = set(sample_indices(total_frames, sample_frames)) if sample_frames > 0 else set()
+        self.matte = matte
+        self.size = None
+        self.references = {}
+
+    def wrap(self, frames: Iterable[Image.Image]) -> Iterator[Image.Image]:
+        """原样产出帧，顺带保存抽样帧"""
+        for i, frame in enumerate(frames):
+            if i in self.indices:
+                if self.size is None:
+                    self.size = analysis_size(frame.size)
+                self.references[i] = to_luma(frame, self.size, self.matte)
+            yield frame
+
+    def positions(self, durations: Optional[List[float]] = None) -> List[Tuple[float, np.ndarray]]:
+        """返回 (抽样帧中点在整个时间轴上的比例, 亮度图)，见 sample_positions()"""
+        return sample_positions(self.references, durations)
+
+
+def sample_positions(references: dict, durations: Optional[List[float]] = None,
+                     total_frames: Optional[int] = None) -> List[Tuple[float, np.ndarray]]:
+    """把 {源帧序号: 亮度图} 换算为 (抽样帧中点在整个时间轴上的比例, 亮度图)
+
+    durations 为源帧时长，None 表示各帧时长相同（total_frames 为总帧数，默认到最后一个抽样帧为止）。
+    按比例而不是绝对时间对齐，输出帧率不同或时长取整时也能对应到同一画面。
+    """
+    count = total_frames or max(references, default=-1) + 1
+    if durations is None or len(durations) < count or sum(durations) <= 0:
+        durations = [1.0] * count
+    total = sum(durations)
+    starts = np.cumsum([0.0] + list(durations[:-1]))
+    return [((starts[i] + durations[i] / 2) / total, references[i])
+            for i in sorted(references)]
+
+
+def iter_decoded(path) -> Iterator[Tuple[Image.Image, float]]:
+    """逐帧解码输出文件（路径或内存中的文件对象），产出 (帧, 文件中记录的显示时长 ms)
+
+    GIF/WebP/APNG 使用 Pillow，MP4/WebM 使用 OpenCV（时长按文件帧率计算）。
+    GIF 编码器和 libwebp 会把连续的相同帧合并为一帧并累加时长，
+    因此解码出的帧数和时长可能与写入时不同，以文件为准。
+    """
+    if isinstance(path, (str, os.PathLike)) and Path(path).suffix.lower() in VIDEO_SUFFIXES:
+        capture = cv2.VideoCapture(str(path))
+        try:
+            fps = capture.get(cv2.CAP_PROP_FPS)
+            duration = 1000 / fps if fps > 0 else 0.0
+            while True:
+                ok, image = capture.read()
+                if not ok:
+                    return
+                yield Image.fromarray(image[:, :, ::-1]), duration
+        finally:
+            capture.release()
+    else:
+        with Image.open(path) as img:
+            for frame in ImageSequence.Iterator(img):
+                # WebP 的帧时长在 load() 之后才写入 info
+                frame.load()
+                yield frame, float(frame.info.get('duration') or 0)
+
+
+def count_frames(path) -> Optional[int]:
+    """输出文件实际包含的帧数（只读取帧结构，不解码像素）；视频格式返回 None"""
+    if Path(path).suffix.lower() in VIDEO_SUFFIXES:
+        return None
+    with Image.open(path) as img:
+        return getattr(img, 'n_frames', 1)
+
+
+def measure_output(path, positions: List[Tuple[float, np.ndarray]],
+                   total_duration: float, size: Tuple[int, int],
+                   matte: Tuple[int, int, int] = DEFAULT_MATTE) -> List[dict]:
+    """把抽样源帧与输出中同一时刻显示的帧比较，返回每个抽样帧的 {'ssim', 'psnr'}
+
+    total_duration 为写入输出的总时长（合并相同帧不改变总时长），
+    抽样点按比例换算为时刻后，在解码出的帧自身的时间轴上查找当时显示的帧；只转换需要比较的帧。
+    保留透明通道的输出先合成到与源帧相同的 matte 背景上再比较。
+    """
+    if not positions or total_duration <= 0:
+        return []
+
+    # 按时刻排序的抽样点，逐帧推进时间轴时依次取出
+    pending = sorted(((fraction * total_duration, reference) for fraction, reference in positions),
+                     key=lambda item: item[0])
+    scores = []
+    elapsed = 0.0
+    last = None
+    for frame, duration in iter_decoded(path):
+        elapsed += duration
+        last = frame
+        if pending[0][0] < elapsed:
+            distorted = to_luma(frame, size, matte)
+            while pending and pending[0][0] < elapsed:
+                scores.append(_score(pending.pop(0)[1], distorted))
+            if not pending:
+                return scores
+
+    # 文件时长因取整略短于写入的总时长时，剩余抽样点与最后一帧比较
+    if last is not None:
+        distorted = to_luma(last, size, matte)
+        scores.extend(_score(reference, distorted) for _, reference in pending)
+    return scores
+
+
+def _score(reference: np.ndarray, distorted: np.ndarray) -> dict:
+    return {'ssim': ssim(reference, distorted), 'psnr': psnr(reference, distorted)}
+
+
+def summarize(scores: List[dict]) -> dict:
+    """统计 SSIM / PSNR 的最小值、平均值和 5 分位数"""
+    summary = {'frames': len(scores)}
+    for metric in ('ssim', 'psnr'):
+        values = np.array([score[metric] for score in scores], dtype=np.float64)
+        if metric == 'psnr':
+            values = np.minimum(values, PSNR_CAP)
+        if values.size:
+            summary[metric] = {
+                'min': float(values.min()),
+                'mean': float(values.mean()),
+                'p5': float(np.percentile(values, 5)),
+            }
+    return summary
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+缩放引擎
+流式管线、多分辨率版本和 WebP 搜索共用的缩放阶段，可选三种实现：
+- pil（默认）：Pillow 的 reducing_gap，先用 reduce() 按整数倍盒式缩小，再对剩下的不到 2 倍做 LANCZOS
+- cv2：OpenCV INTER_AREA（面积平均，缩小时质量好且最快）
+- numpy：NumPy 按整数倍块平均预缩小，再用 Pillow LANCZOS 缩放到目标尺寸
+大比例缩小（如 1080p → 480p）时，LANCZOS 只作用在已经缩小过的图像上，开销大幅下降。
+带透明通道的帧按预乘透明度缩放，透明像素的颜色不会渗入边缘。
+缩放按请求的尺寸进行；偶数宽高只是视频编码的要求，由视频写入器处理，
+even_size 供需要自行计算偶数尺寸的地方（如基准测试）使用，与其他模块一样奇数宽高向上取偶数。
+"""
+
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from lazy_imports import LazyModule, has_module
+
+np = LazyModule('numpy')
+cv2 = LazyModule('cv2')
+
+RESIZE_ENGINES = ('auto', 'pil', 'cv2', 'numpy')
+
+# 预缩小后至少保留目标尺寸的倍数，最后一步 LANCZOS 仍有足够的采样
+REDUCING_GAP = 2.0
+
+
+def even_size(size: Tuple[int, int]) -> Tuple[int, int]:
+    """宽高向上取偶数（最小为 2），视频编码要求偶数尺寸"""
+    width, height = size
+    return max(2, width + width % 2), max(2, height + height % 2)
+
+
+def resolve_engine(engine: str = 'auto') -> str:
+    """确定实际使用的引擎：auto 在安装了 OpenCV 时使用 cv2，否则使用 pil
+
+    各处默认使用 pil，输出与只安装 Pillow 时一致；auto 需要显式选择。
+    """
+    if engine not in RESIZE_ENGINES:
+        raise ValueError(f"不支持的缩放引擎: {engine}")
+    if engine == 'auto':
+        return 'cv2' if has_module('cv2') else 'pil'
+    return engine
+
+
+def reduce_factor(source: Tuple[int, int], target: Tuple[int, int]) -> int:
+    """整数预缩小倍数：缩小后宽高仍不小于目标的 REDUCING_GAP 倍"""
+    factor = int(min(source[0] / target[0], source[1] / target[1]) / REDUCING_GAP)
+    return max(1, factor)
+
+
+def _pil_resize(frame: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    return frame.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def _cv2_resize(frame: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    upscale = size[0] > frame.width or size[1] > frame.height
+    interpolation = cv2.INTER_CUBIC if upscale else cv2.INTER_AREA
+    return Image.fromarray(cv2.resize(np.asarray(frame), size, interpolation=interpolation), frame.mode)
+
+
+def _numpy_resize(frame: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    factor = reduce_factor(frame.size, size)
+    if factor > 1:
+        array = np.asarray(frame)
+        height, width = array.shape[0] // factor * factor, array.shape[1] // factor * factor
+        # 裁掉不足一个块的边缘（最多 factor - 1 像素），按 factor x factor 块求和再取平均；
+        # 逐个偏移做步长切片相加，只在缩小后的尺寸上运算
+        count = factor * factor
+        # 块内像素和不超过 65535 时用 uint16 累加，内存带宽减半
+        dtype = np.uint16 if count * 255 <= 0xFFFF else np.uint32
+        total = np.zeros((height // factor, width // factor) + array.shape[2:], dtype=dtype)
+        for dy in range(factor):
+            for dx in range(factor):
+                total += array[dy:height:factor, dx:width:factor]
+        frame = Image.fromarray(((total + count // 2) // count).astype(np.uint8), frame.mode)
+    return frame.resize(size, Image.Resampling.LANCZOS)
+
+
+_ENGINES = {
+    'pil': _pil_resize,
+    'cv2': _cv2_resize,
+    'numpy': _numpy_resize,
+}
+
+# 引擎可以直接处理的模式；其他模式先转换为 RGB / RGBA
+_ARRAY_MODES = ('RGB', 'L', 'RGBa')
+
+
+def resize_frame(frame: Image.Image, size: Optional[Tuple[int, int]],
+                 engine: str = 'pil') -> Image.Image:
+    """把帧缩放到 size（None 或尺寸相同时原样返回）"""
+    if not size or frame.size == tuple(size):
+        return frame
+    size = tuple(size)
+    resize = _ENGINES[resolve_engine(engine)]
+
+    if frame.mode == 'RGBA':
+        # 预乘透明度后再缩放，透明像素不参与颜色平均
+        return resize(frame.convert('RGBa'), size).convert('RGBA')
+    if frame.mode not in _ARRAY_MODES:
+        alpha = 'A' in frame.mode or 'transparency' in frame.info
+        frame = frame.convert('RGBA' if alpha else 'RGB')
+        return resize_frame(frame, size, engine)
+    return resize(frame, size)
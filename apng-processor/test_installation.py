@@ -12,7 +12,6 @@ def test_imports():
     
     required_modules = [
         ('PIL', 'Pillow'),
-        ('imageio', 'imageio'),
         ('numpy', 'numpy'),
         ('tqdm', 'tqdm'),
         ('cv2', 'opencv-python')
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+WebP 目标大小 / 目标质量搜索
+对编码质量和分辨率做二分搜索，直到输出满足字节预算（如 1.5MB）
+或 SSIM/PSNR 下限。解码、合成后的帧只准备一次，每个分辨率的缩放帧
+和每次编码的结果都会缓存，搜索过程中不会重复解码或缩放。
+"""
+
+import io
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from apng_processor import RESAMPLE_MODES, ResamplingWriter, TimelineResampler, WebPWriter, nominal_fps
+from frame_store import FrameStore
+from quality_metrics import measure_output, sample_indices, sample_positions, to_luma
+from resizing import resize_frame, resolve_engine
+
+# 依次尝试的分辨率比例（相对于输入帧）
+DEFAULT_SCALES = (1.0, 0.85, 0.7, 0.55, 0.4)
+
+# 编码质量的搜索范围
+QUALITY_RANGE = (10, 95)
+
+# 计算质量指标时抽样的帧数
+METRIC_SAMPLE_FRAMES = 8
+
+SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'K': 1024, 'MB': 1024 ** 2, 'M': 1024 ** 2,
+              'GB': 1024 ** 3, 'G': 1024 ** 3}
+
+
+def parse_size(text) -> int:
+    """解析字节数，支持 1500000、800KB、1.5MB 等写法"""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([A-Za-z]*)\s*', str(text))
+    if not match or match.group(2).upper() not in SIZE_UNITS:
+        raise ValueError(f"无法解析的大小: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def scaled_size(size: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    """按比例缩放尺寸（WebP 不要求偶数宽高）；原始比例保持原图尺寸"""
+    if scale >= 1:
+        return tuple(size)
+    width, height = size
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+class WebPSearch:
+    """在给定帧上搜索满足约束的 WebP 编码参数
+
+    frames 为已合成、已缩放的 RGB 帧（列表或 FrameStore），只读取不修改。
+    输入为 FrameStore 时，各比例的缩放帧也写入同一目录下的帧存储。
+    durations 为源帧时长，提供时按 resample 把源时间轴重采样到 fps（与 process_all 相同），
+    否则每帧按 fps 的固定时长写入。
+    质量指标在输入帧的尺寸上计算（缩小编码的输出先放大回原尺寸），分辨率损失会计入 SSIM/PSNR。
+    """
+
+    def __init__(self, frames: List[Image.Image], fps: float = 15,
+                 durations: Optional[List[float]] = None,
+                 scales=DEFAULT_SCALES, quality_range=QUALITY_RANGE,
+                 sample_frames: int = METRIC_SAMPLE_FRAMES,
+                 resize_engine: str = 'pil',
+                 resample: str = 'nearest'):
+        if not frames:
+            raise Exception("没有可用的帧")
+        if resample not in RESAMPLE_MODES:
+            raise ValueError(f"不支持的重采样方式: {resample}")
+        self.frames = frames
+        self.resize_engine = resolve_engine(resize_engine)
+        self.fps = fps
+        self.durations = durations if durations and len(durations) == len(frames) else None
+        self.resample = resample
+        self.scales = scales
+        self.quality_range = quality_range
+        self.base_size = frames[0].size
+        kept = self.kept_indices()
+        self.sample = [kept[i] for i in sample_indices(len(kept), sample_frames)]
+        self._positions = None
+
+        self._scaled: Dict[float, List[Image.Image]] = {}
+        self._encoded: Dict[Tuple[float, int], bytes] = {}
+        self._written: Dict[Tuple[float, int], float] = {}
+        self._metrics: Dict[Tuple[float, int], dict] = {}
+        self.encodes = 0
+
+    def kept_indices(self) -> List[int]:
+        """重采样后保留的输入帧序号
+
+        nearest 重采样丢弃的帧不会出现在输出中，只从保留的帧中抽样，
+        质量下限衡量的是编码损失而不是丢帧；blend 和不重采样时所有帧都参与抽样。
+        """
+        if not self.durations or self.resample != 'nearest':
+            return list(range(len(self.frames)))
+        resampler = TimelineResampler(self.fps, 'nearest', nominal_fps(self.durations))
+        kept = []
+        for i, duration in enumerate(self.durations):
+            kept += [index for index, _ in resampler.add(i, duration)]
+        return kept + [index for index, _ in resampler.flush()]
+
+    def scaled_frames(self, scale: float) -> List[Image.Image]:
+        """返回指定比例的帧（每个比例只缩放一次）"""
+        if scale not in self._scaled:
+            size = scaled_size(self.base_size, scale)
+            if size == self.base_size:
+                self._scaled[scale] = self.frames
+            elif isinstance(self.frames, FrameStore):
+                store = FrameStore(len(self.frames), size, self.frames.mode,
+                                   directory=os.path.dirname(self.frames.path))
+                for frame in self.frames:
+                    store.append(resize_frame(frame, size, self.resize_engine))
+                store.flush()
+                self._scaled[scale] = store
+            else:
+                self._scaled[scale] = [resize_frame(frame, size, self.resize_engine)
+                                       for frame in self.frames]
+        return self._scaled[scale]
+
+    def close(self):
+        """释放缩放帧的帧存储（输入帧由调用方负责）"""
+        for frames in self._scaled.values():
+            if frames is not self.frames and isinstance(frames, FrameStore):
+                frames.close()
+        self._scaled = {}
+
+    def encode(self, scale: float, quality: int) -> bytes:
+        """编码到内存并缓存结果"""
+        key = (scale, quality)
+        if key not in self._encoded:
+            buffer = io.BytesIO()
+            writer = WebPWriter(buffer, quality=quality, fps=self.fps)
+            if self.durations and self.resample != 'none':
+                writer = ResamplingWriter(writer, self.fps, self.resample, nominal_fps(self.durations))
+            for i, frame in enumerate(self.scaled_frames(scale)):
+                writer.add(frame, self.durations[i] if self.durations else None)
+            writer.close()
+            self._encoded[key] = buffer.getvalue()
+            # 写入的总时长，质量检查按比例换算抽样帧的时刻
+            self._written[key] = sum(writer.durations)
+            self.encodes += 1
+        return self._encoded[key]
+
+    def positions(self) -> list:
+        """抽样输入帧的原尺寸亮度图及其在时间轴上的位置（只计算一次）"""
+        if self._positions is None:
+            references = {i: to_luma(self.frames[i]) for i in self.sample}
+            self._positions = sample_positions(references, self.durations, len(self.frames))
+        return self._positions
+
+    def metrics(self, scale: float, quality: int) -> dict:
+        """解码输出，按时间轴找到抽样帧对应的画面，计算相对输入帧的最低 SSIM / PSNR
+
+        libwebp 会合并连续的相同帧，输出帧序号与输入不一定对应，因此按时刻对齐。
+        """
+        key = (scale, quality)
+        if key not in self._metrics:
+            data = self.encode(scale, quality)
+            scores = measure_output(io.BytesIO(data), self.positions(), self._written[key],
+                                    self.base_size)
+            self._metrics[key] = {
+                'ssim': min(score['ssim'] for score in scores),
+                'psnr': min(score['psnr'] for score in scores),
+            }
+        return self._metrics[key]
+
+    def meets_floor(self, scale: float, quality: int,
+                    min_ssim: Optional[float], min_psnr: Optional[float]) -> bool:
+        if min_ssim is None and min_psnr is None:
+            return True
+        metrics = self.metrics(scale, quality)
+        return ((min_ssim is None or metrics['ssim'] >= min_ssim) and
+                (min_psnr is None or metrics['psnr'] >= min_psnr))
+
+    def _bisect(self, low: int, high: int, predicate, want_highest: bool) -> Optional[int]:
+        """在 [low, high] 中二分查找满足单调条件的最高（或最低）质量
+
+        先检查两端，整个区间都满足或都不满足时只需一两次编码。
+        编码和指标都有缓存，重复检查同一质量不会重新编码。
+        """
+        first, last = (high, low) if want_highest else (low, high)
+        if predicate(first):
+            return first
+        if not predicate(last):
+            return None
+
+        found = last
+        while low <= high:
+            mid = (low + high) // 2
+            if predicate(mid):
+                found = mid
+                if want_highest:
+                    low = mid + 1
+                else:
+                    high = mid - 1
+            elif want_highest:
+                high = mid - 1
+            else:
+                low = mid + 1
+        return found
+
+    def run(self, max_bytes: Optional[int] = None,
+            min_ssim: Optional[float] = None,
+            min_psnr: Optional[float] = None) -> dict:
+        """执行搜索，返回最佳结果
+
+        有字节预算时按分辨率从大到小，取预算内最高的质量，
+        第一个同时满足质量下限的分辨率即为结果；
+        只有质量下限时，在每个分辨率上找满足下限的最低质量，取文件最小的一个。
+        都不满足时返回预算内质量最好的结果，met 为 False。
+        """
+        if max_bytes is None and min_ssim is None and min_psnr is None:
+            raise ValueError("至少需要指定 max_bytes、min_ssim 或 min_psnr 之一")
+
+        min_quality, max_quality = self.quality_range
+        best = None
+        fallback = None
+
+        for scale in self.scales:
+            if max_bytes is not None:
+                # 分辨率越小，预算内能用的质量只会更高
+                quality = self._bisect(min_quality, max_quality,
+                                       lambda q: len(self.encode(scale, q)) <= max_bytes,
+                                       want_highest=True)
+                if quality is None:
+                    # 最低质量也超出预算，尝试更小的分辨率
+                    continue
+            else:
+                quality = max_quality
+
+            if not self.meets_floor(scale, quality, min_ssim, min_psnr):
+                candidate = self._result(scale, quality, met=False)
+                if fallback is None or candidate['ssim'] > fallback['ssim']:
+                    fallback = candidate
+                min_quality = quality
+                if max_bytes is None:
+                    # 更小的分辨率质量只会更低
+                    break
+                continue
+
+            if max_bytes is not None:
+                # 预算内质量最高、分辨率最大的结果
+                return self._result(scale, quality, met=True)
+
+            quality = self._bisect(min_quality, quality,
+                                   lambda q: self.meets_floor(scale, q, min_ssim, min_psnr),
+                                   want_highest=False)
+            # 分辨率越小，满足下限所需的质量只会更高，缩小下一轮的搜索范围
+            min_quality = quality
+            candidate = self._result(scale, quality, met=True)
+            if best is None or candidate['size_bytes'] < best['size_bytes']:
+                best = candidate
+
+        result = best or fallback
+        if result is None:
+            # 最小分辨率、最低质量仍超出预算
+            result = self._result(self.scales[-1], self.quality_range[0], met=False)
+        return result
+
+    def _result(self, scale: float, quality: int, met: bool) -> dict:
+        data = self.encode(scale, quality)
+        metrics = self.metrics(scale, quality)
+        return {
+            'scale': scale,
+            'size': scaled_size(self.base_size, scale),
+            'quality': quality,
+            'size_bytes': len(data),
+            'ssim': metrics['ssim'],
+            'psnr': metrics['psnr'],
+            'met': met,
+            'encodes': self.encodes,
+            'data': data,
+        }
+
+
+def search_webp(frames: List[Image.Image], output_path: str,
+                max_bytes: Optional[int] = None,
+                min_ssim: Optional[float] = None,
+                min_psnr: Optional[float] = None,
+                fps: float = 15,
+                durations: Optional[List[float]] = None,
+                scales=DEFAULT_SCALES,
+                resize_engine: str = 'pil',
+                resample: str = 'nearest') -> dict:
+    """搜索满足约束的 WebP 参数并写出结果，返回搜索结果（不含编码数据）
+
+    durations 为源帧时长，提供时输出与源文件时长一致（见 WebPSearch）。
+    """
+    search = WebPSearch(frames, fps=fps, durations=durations, scales=scales,
+                        resize_engine=resize_engine, resample=resample)
+    try:
+        result = search.run(max_bytes=max_bytes, min_ssim=min_ssim, min_psnr=min_psnr)
+    finally:
+        search.close()
+
+    with open(output_path, 'wb') as f:
+        f.write(result.pop('data'))
+    result['output_path'] = str(output_path)
+    return result